@@ -1,29 +1,63 @@
 from __future__ import annotations
 
-import shutil
 import sys
+import tempfile
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from loguru import logger
+from rich.console import Console
 
-from brats.core.docker import run_container
+from brats.core.docker import prewarm_container, run_container
 from brats.utils.algorithm_config import load_algorithms
 from brats.constants import OUTPUT_NAME_SCHEMA, Algorithms, Task
-from brats.utils.data_handling import InferenceSetup
-
-# Remove the default logger and add one with level INFO
-logger.remove()
-logger.add(
-    sys.stderr,
-    level="INFO",
+from brats.utils.data_handling import (
+    InferenceSetup,
+    clear_tmp_folder,
+    find_subject_folders,
+    move_file,
+    remove_tmp_folder,
 )
+from brats.utils.lazy_import import force_load, lazy_import
+
+nib = lazy_import("nibabel")
+
+# staging inputs is I/O bound, more threads than this rarely help on a single disk
+_MAX_STAGING_WORKERS = 8
+
+
+def _configure_default_logger() -> None:
+    """Replace loguru's default handler with one of level INFO.
+    If the default handler was already removed (i.e. the user configured logging), the handlers are left untouched.
+    """
+    try:
+        logger.remove(0)
+    except ValueError:
+        return
+    logger.add(
+        sys.stderr,
+        level="INFO",
+        # do not walk the stack frames to render variable values for every logged exception
+        diagnose=False,
+    )
+
+
+_configure_default_logger()
 
 
 class BraTSAlgorithm(ABC):
     """
     This class serves as the basis for all BraTS algorithms. It provides a common interface and implements the logic for single and batch inference.
+
+    It can be used as a context manager to reuse one temporary data folder across repeated inference calls, e.g.:
+
+    .. code-block:: python
+
+        with AdultGliomaPreTreatmentSegmenter() as segmenter:
+            for subject in subjects:
+                segmenter.infer_single(...)
     """
 
     def __init__(
@@ -45,10 +79,60 @@ class BraTSAlgorithm(ABC):
         # data for selected algorithm
         self.algorithm = self.algorithm_list[algorithm.value]
 
+        # temporary data folder reused across inference calls while used as context manager
+        self._tmp_data_folder: Optional[Path] = None
+
         logger.info(
             f"Instantiated {self.__class__.__name__} with algorithm: {self.algorithm_key} by {self.algorithm.meta.authors}"
         )
 
+    def __enter__(self) -> BraTSAlgorithm:
+        self._tmp_data_folder = Path(tempfile.mkdtemp(prefix="data_"))
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self._tmp_data_folder is not None:
+            remove_tmp_folder(self._tmp_data_folder)
+            self._tmp_data_folder = None
+
+    def prewarm(self) -> None:
+        """Pull the docker image and download the additional files of the selected algorithm ahead of the first inference.
+        Useful e.g. in interactive sessions to exclude these one-time costs from subsequent inference calls.
+        """
+        prewarm_container(algorithm=self.algorithm)
+
+    def _get_reusable_tmp_data_folder(self) -> Optional[Path]:
+        """Get the emptied temporary data folder if used as context manager.
+
+        Returns:
+            Optional[Path]: The reusable data folder or None if a fresh one should be created per inference
+        """
+        if self._tmp_data_folder is None:
+            return None
+        clear_tmp_folder(self._tmp_data_folder)
+        if any(self._tmp_data_folder.iterdir()):
+            # leftovers (e.g. files created by root containers) would leak into the next run
+            remove_tmp_folder(self._tmp_data_folder)
+            self._tmp_data_folder = Path(tempfile.mkdtemp(prefix="data_"))
+        return self._tmp_data_folder
+
+    def _get_tmp_output_parent(self, destination: Path) -> Optional[Path]:
+        """Get the folder in which the temporary output folder is created.
+
+        Placing it in the destination folder allows moving outputs with a rename instead of a copy.
+        Containers running as root would however leave root-owned leftovers there that the user can not delete,
+        so their outputs are staged in the system temp directory instead.
+
+        Args:
+            destination (Path): Folder the outputs are saved to
+
+        Returns:
+            Optional[Path]: The destination folder or None to use the system temp directory
+        """
+        if self.algorithm.run_args.requires_root:
+            return None
+        return destination
+
     @abstractmethod
     def _standardize_single_inputs(
         self,
@@ -71,6 +155,38 @@ class BraTSAlgorithm(ABC):
         """
         pass
 
+    def _standardize_subjects(
+        self, data_folder: Path, subject_inputs: Dict[str, Dict[str, Path | str]]
+    ) -> None:
+        """Standardize the inputs of multiple subjects concurrently. Staging is I/O bound, so threads suffice.
+
+        Args:
+            data_folder (Path): Parent folder where the subject folders will be created
+            subject_inputs (Dict[str, Dict[str, Path | str]]): Mapping from internal subject ID to the subject's input images
+        """
+        subject_ids = list(subject_inputs)
+        if not subject_ids:
+            return
+
+        def standardize(subject_id: str) -> None:
+            self._standardize_single_inputs(
+                data_folder=data_folder,
+                subject_id=subject_id,
+                inputs=subject_inputs[subject_id],
+                subject_modality_separator=self.algorithm.run_args.subject_modality_separator,
+            )
+
+        # the first subject is handled on the calling thread, a single subject needs no pool
+        standardize(subject_ids[0])
+        if len(subject_ids) > 1:
+            # the input sanity check only falls back to nibabel for some headers, so the first subject does not necessarily load it.
+            # it has to be loaded before fanning out since lazy loading is not thread-safe
+            force_load(nib)
+            with ThreadPoolExecutor(
+                max_workers=min(_MAX_STAGING_WORKERS, len(subject_ids) - 1)
+            ) as executor:
+                list(executor.map(standardize, subject_ids[1:]))
+
     def _process_single_output(
         self, tmp_output_folder: Path | str, subject_id: str, output_file: Path
     ) -> None:
@@ -80,21 +196,21 @@ class BraTSAlgorithm(ABC):
         Args:
             tmp_output_folder (Path | str): Folder with the algorithm output
             subject_id (str): Subject ID of the output
-            output_file (Path): Path to the desired output file
+            output_file (Path): Path to the desired output file (its parent folder must exist)
         """
         # rename output
         if self.task == Task.MISSING_MRI:
             # Missing MRI has no fixed names since the missing modality differs and is included in the name
-            algorithm_output = Path(tmp_output_folder).iterdir().__next__()
+            algorithm_output = (
+                Path(tmp_output_folder).glob(f"*{subject_id}*").__next__()
+            )
         else:
             algorithm_output = Path(tmp_output_folder) / OUTPUT_NAME_SCHEMA[
                 self.task
             ].format(subject_id=subject_id)
 
-        # ensure path exists and rename output to the desired path
-        output_file = Path(output_file).absolute()
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(algorithm_output, output_file)
+        # rename output to the desired path
+        move_file(algorithm_output, output_file)
 
     def _process_batch_output(
         self,
@@ -107,12 +223,10 @@ class BraTSAlgorithm(ABC):
 
         Args:
             tmp_output_folder (Path | str): Folder with the algorithm outputs
-            output_folder (Path): Folder to save the outputs
+            output_folder (Path): Existing folder to save the outputs
             mapping (dict[str, str]): Mapping from internal to external subject names
         """
         # move outputs and change name back to initially provided one
-        output_folder = Path(output_folder)
-        output_folder.mkdir(parents=True, exist_ok=True)
         for internal_name, external_name in mapping.items():
             if self.task == Task.MISSING_MRI:
                 # Missing MRI has no fixed names since the missing modality differs and is included in the name
@@ -135,7 +249,7 @@ class BraTSAlgorithm(ABC):
                     self.task
                 ].format(subject_id=internal_name)
                 output_file = output_folder / f"{external_name}.nii.gz"
-            shutil.move(algorithm_output, output_file)
+            move_file(algorithm_output, output_file)
 
     def _infer_single(
         self,
@@ -151,7 +265,14 @@ class BraTSAlgorithm(ABC):
             output_file (Path | str): File to save the output
             log_file (Optional[Path  |  str], optional): Log file with extra information. Defaults to None.
         """
-        with InferenceSetup(log_file=log_file) as (tmp_data_folder, tmp_output_folder):
+        # create the destination upfront so the temporary output folder can be placed on the same file system (see _get_tmp_output_parent)
+        output_file = Path(output_file).absolute()
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with InferenceSetup(
+            log_file=log_file,
+            tmp_output_parent=self._get_tmp_output_parent(output_file.parent),
+            tmp_data_folder=self._get_reusable_tmp_data_folder(),
+        ) as (tmp_data_folder, tmp_output_folder):
             logger.info(f"Performing single inference")
 
             # the id here is arbitrary
@@ -176,7 +297,70 @@ class BraTSAlgorithm(ABC):
                 subject_id=subject_id,
                 output_file=output_file,
             )
-            logger.info(f"Saved output to: {Path(output_file).absolute()}")
+            logger.info(f"Saved output to: {output_file}")
+
+    def _infer_many(
+        self,
+        inputs: List[Dict[str, Path | str]],
+        output_files: List[Path | str],
+        log_file: Optional[Path | str] = None,
+    ) -> None:
+        """
+        Perform inference for multiple subjects with a single container run and save each output in the specified file.
+
+        Args:
+            inputs (List[Dict[str, Path | str]]): Input images for each subject
+            output_files (List[Path | str]): Files to save the outputs, one per subject
+            log_file (Optional[Path  |  str], optional): Log file with extra information. Defaults to None.
+
+        Raises:
+            ValueError: If no inputs are provided or the number of input sets and output files differ
+        """
+        if not inputs:
+            raise ValueError("At least one input set is required.")
+        if len(inputs) != len(output_files):
+            raise ValueError(
+                f"Number of input sets ({len(inputs)}) and output files ({len(output_files)}) must match."
+            )
+        # create the destinations upfront so the temporary output folder can be placed on the same file system (see _get_tmp_output_parent)
+        output_files = [Path(output_file).absolute() for output_file in output_files]
+        for parent in {output_file.parent for output_file in output_files}:
+            parent.mkdir(parents=True, exist_ok=True)
+        with InferenceSetup(
+            log_file=log_file,
+            tmp_output_parent=self._get_tmp_output_parent(output_files[0].parent),
+            tmp_data_folder=self._get_reusable_tmp_data_folder(),
+        ) as (tmp_data_folder, tmp_output_folder):
+            logger.info(f"Performing inference for {len(inputs)} subjects")
+
+            subject_ids = [
+                self.algorithm.run_args.input_name_schema.format(id=i)
+                for i in range(len(inputs))
+            ]
+            internal_external_name_map = {
+                subject_id: output_file.name
+                for subject_id, output_file in zip(subject_ids, output_files)
+            }
+            self._standardize_subjects(
+                data_folder=tmp_data_folder,
+                subject_inputs=dict(zip(subject_ids, inputs)),
+            )
+
+            run_container(
+                algorithm=self.algorithm,
+                data_path=tmp_data_folder,
+                output_path=tmp_output_folder,
+                cuda_devices=self.cuda_devices,
+                force_cpu=self.force_cpu,
+                internal_external_name_map=internal_external_name_map,
+            )
+            for subject_id, output_file in zip(subject_ids, output_files):
+                self._process_single_output(
+                    tmp_output_folder=tmp_output_folder,
+                    subject_id=subject_id,
+                    output_file=output_file,
+                )
+            logger.info(f"Saved {len(output_files)} outputs")
 
     def _infer_batch(
         self,
@@ -185,16 +369,23 @@ class BraTSAlgorithm(ABC):
         log_file: Optional[Path | str] = None,
     ):
         """Perform a batch inference run with the provided inputs and save the outputs in the specified folder.
+        If multiple CUDA devices are specified (e.g. "0,1"), the subjects are split across the devices and processed by one container per device concurrently.
 
         Args:
             data_folder (Path | str): Folder with the input data
             output_folder (Path | str): Folder to save the outputs
             log_file (Optional[Path  |  str], optional): Log file with extra information. Defaults to None.
         """
-        with InferenceSetup(log_file=log_file) as (tmp_data_folder, tmp_output_folder):
-
-            # find subjects
-            subjects = [f for f in Path(data_folder).iterdir() if f.is_dir()]
+        # create the destination upfront so the temporary output folder can be placed on the same file system (see _get_tmp_output_parent)
+        output_folder = Path(output_folder).absolute()
+        output_folder.mkdir(parents=True, exist_ok=True)
+        # find subjects before the temporary output folder is created, it may be placed inside the data folder
+        subjects = find_subject_folders(data_folder)
+        with InferenceSetup(
+            log_file=log_file,
+            tmp_output_parent=self._get_tmp_output_parent(output_folder),
+            tmp_data_folder=self._get_reusable_tmp_data_folder(),
+        ) as (tmp_data_folder, tmp_output_folder):
             logger.info(
                 f"Found {len(subjects)} subjects: {', '.join([s.name for s in subjects][:5])} {' ...' if len(subjects) > 5 else '' }"
             )
@@ -206,20 +397,109 @@ class BraTSAlgorithm(ABC):
             )
             logger.info(f"Standardized input names to match algorithm requirements.")
 
-            # run inference in container
-            run_container(
-                algorithm=self.algorithm,
-                data_path=tmp_data_folder,
-                output_path=tmp_output_folder,
-                cuda_devices=self.cuda_devices,
-                force_cpu=self.force_cpu,
-                internal_external_name_map=internal_external_name_map,
+            cuda_devices = self._get_cuda_devices()
+            if len(cuda_devices) > 1 and len(internal_external_name_map) > 1:
+                self._infer_shards(
+                    tmp_data_folder=tmp_data_folder,
+                    tmp_output_folder=tmp_output_folder,
+                    output_folder=output_folder,
+                    internal_external_name_map=internal_external_name_map,
+                    cuda_devices=cuda_devices,
+                )
+            else:
+                # run inference in container
+                run_container(
+                    algorithm=self.algorithm,
+                    data_path=tmp_data_folder,
+                    output_path=tmp_output_folder,
+                    cuda_devices=self.cuda_devices,
+                    force_cpu=self.force_cpu,
+                    internal_external_name_map=internal_external_name_map,
+                )
+
+                self._process_batch_output(
+                    tmp_output_folder=tmp_output_folder,
+                    output_folder=output_folder,
+                    mapping=internal_external_name_map,
+                )
+
+            logger.info(f"Saved outputs to: {output_folder}")
+
+    def _get_cuda_devices(self) -> List[str]:
+        """Get the individual CUDA devices to distribute batch inference across.
+
+        Returns:
+            List[str]: The CUDA device ids, empty if CPU execution is forced
+        """
+        if self.force_cpu or not self.cuda_devices:
+            return []
+        return [
+            device.strip() for device in self.cuda_devices.split(",") if device.strip()
+        ]
+
+    def _infer_shards(
+        self,
+        tmp_data_folder: Path,
+        tmp_output_folder: Path,
+        output_folder: Path,
+        internal_external_name_map: Dict[str, str],
+        cuda_devices: List[str],
+    ) -> None:
+        """Distribute the standardized subjects round-robin across the CUDA devices and run one container per device concurrently.
+
+        Args:
+            tmp_data_folder (Path): Folder with the standardized subject folders
+            tmp_output_folder (Path): Folder in which the per device output folders are created
+            output_folder (Path): Folder to save the outputs
+            internal_external_name_map (Dict[str, str]): Mapping from internal to external subject names
+            cuda_devices (List[str]): The CUDA devices to use, one container each
+        """
+        internal_names = list(internal_external_name_map)
+        shards = []
+        for i, device in enumerate(cuda_devices):
+            mapping = {
+                internal_name: internal_external_name_map[internal_name]
+                for internal_name in internal_names[i :: len(cuda_devices)]
+            }
+            if not mapping:
+                continue
+            shard_data_folder = tmp_data_folder / f"shard_{i}"
+            shard_data_folder.mkdir()
+            for internal_name in mapping:
+                move_file(
+                    tmp_data_folder / internal_name, shard_data_folder / internal_name
+                )
+            shards.append(
+                (device, shard_data_folder, tmp_output_folder / f"shard_{i}", mapping)
             )
+        logger.info(
+            f"Distributing {len(internal_names)} subjects across CUDA devices: {', '.join(shard[0] for shard in shards)}"
+        )
+
+        # pull the image (with its progress bars) before the shared spinner is shown, rich supports only one live display at a time
+        prewarm_container(algorithm=self.algorithm)
+        with Console().status(
+            f"Running inference on {len(shards)} CUDA devices..."
+        ), ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(
+                    run_container,
+                    algorithm=self.algorithm,
+                    data_path=shard_data_folder,
+                    output_path=shard_output_folder,
+                    cuda_devices=device,
+                    force_cpu=self.force_cpu,
+                    internal_external_name_map=mapping,
+                    show_status=False,
+                )
+                for device, shard_data_folder, shard_output_folder, mapping in shards
+            ]
+            for future in futures:
+                future.result()
 
+        for _, _, shard_output_folder, mapping in shards:
             self._process_batch_output(
-                tmp_output_folder=tmp_output_folder,
+                tmp_output_folder=shard_output_folder,
                 output_folder=output_folder,
-                mapping=internal_external_name_map,
+                mapping=mapping,
             )
-
-            logger.info(f"Saved outputs to: {Path(output_folder).absolute()}")
@@ -2,14 +2,16 @@ from __future__ import annotations
 
 import os
 import subprocess
+import threading
 import time
+from contextlib import nullcontext
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import docker
-import nibabel as nib
-import numpy as np
 from docker.errors import DockerException
+from docker.utils import parse_bytes, parse_repository_tag
 from loguru import logger
 from rich.console import Console
 from rich.progress import Progress
@@ -20,8 +22,13 @@ from brats.utils.exceptions import (
     AlgorithmNotCPUCompatibleException,
     BraTSContainerException,
 )
+from brats.utils.lazy_import import lazy_import
 from brats.utils.zenodo import check_additional_files_path, get_dummy_path
 
+# only required to check outputs, loaded on first use to keep the package import fast
+nib = lazy_import("nibabel")
+np = lazy_import("numpy")
+
 try:
     client = docker.from_env()
 except DockerException as e:
@@ -30,6 +37,20 @@ except DockerException as e:
     )
     # not aborting since this happens during read the docs builds. not a great solution tbf
 
+# additional files are checked (and downloaded) once per record and process, the lock serializes concurrent runs
+_ADDITIONAL_FILES_PATHS: Dict[str, Path] = {}
+_ADDITIONAL_FILES_LOCK = threading.Lock()
+
+# images known to be present locally, the lock prevents concurrent runs from pulling the same image twice
+_PRESENT_IMAGES: Set[str] = set()
+_PRESENT_IMAGES_LOCK = threading.Lock()
+
+# exists if the NVIDIA kernel driver is loaded
+_NVIDIA_DRIVER_VERSION_FILE = "/proc/driver/nvidia/version"
+
+# without a terminal, pull progress is logged in steps of this many percent instead of rendering progress bars
+_PULL_LOG_STEP = 10
+
 
 def _show_docker_pull_progress(tasks: Dict, progress: Progress, line: Dict):
     """Show the progress of a docker pull operation.
@@ -54,23 +75,104 @@ def _show_docker_pull_progress(tasks: Dict, progress: Progress, line: Dict):
         progress.update(tasks[task_key], completed=line["progressDetail"]["current"])
 
 
+@lru_cache(maxsize=None)
+def _get_user() -> str:
+    """Get the user and group ids of the current process as docker user argument. The ids cannot change during the lifetime of the process, so they are resolved once (on first use, os.getuid is not available on Windows).
+
+    Returns:
+        str: The user argument in the format "uid:gid"
+    """
+    return f"{os.getuid()}:{os.getgid()}"
+
+
+def _log_pull_lines(lines: Iterable[Dict]):
+    """Log coarse progress of a docker pull operation, used instead of progress bars when stderr is neither a terminal nor a Jupyter notebook.
+
+    Args:
+        lines (Iterable[Dict]): The lines of the docker.client.api.pull stream
+    """
+    logged_percentages = {}
+    for line in lines:
+        if line.get("status") not in ("Downloading", "Extracting"):
+            continue
+        total = line.get("progressDetail", {}).get("total")
+        if not total:
+            continue
+        task_key = f'{line["status"]} {line["id"]}'
+        percentage = 100 * line["progressDetail"]["current"] // total
+        last_percentage = logged_percentages.get(task_key)
+        if last_percentage is None or percentage - last_percentage >= _PULL_LOG_STEP:
+            logged_percentages[task_key] = percentage
+            logger.info("{}: {}%", task_key, percentage)
+
+
 def _ensure_image(image: str):
     """Ensure the docker image is present on the system. If not, pull it.
+    Images are only looked up once per process (once confirmed present), later calls return immediately.
 
     Args:
         image (str): The docker image to pull
+
+    Raises:
+        BraTSContainerException: If the image could not be pulled
     """
-    if not client.images.list(name=image):
-        logger.info(f"Pulling docker image {image}")
-        tasks = {}
-        with Progress() as progress:
+    if image in _PRESENT_IMAGES:
+        return
+    with _PRESENT_IMAGES_LOCK:
+        if image in _PRESENT_IMAGES:
+            return
+        if not client.images.list(name=image):
+            logger.info(f"Pulling docker image {image}")
             resp = client.api.pull(image, stream=True, decode=True)
-            for line in resp:
-                _show_docker_pull_progress(tasks=tasks, progress=progress, line=line)
+            # pull failures are reported as error lines in the stream, not raised
+            errors = []
+
+            def progress_lines() -> Iterable[Dict]:
+                for line in resp:
+                    if "error" in line:
+                        errors.append(line["error"])
+                    else:
+                        yield line
+
+            console = Console(stderr=True)
+            if console.is_terminal or console.is_jupyter:
+                tasks = {}
+                with Progress(console=console) as progress:
+                    for line in progress_lines():
+                        _show_docker_pull_progress(
+                            tasks=tasks, progress=progress, line=line
+                        )
+            else:
+                _log_pull_lines(progress_lines())
+            if errors or not client.images.list(name=image):
+                raise BraTSContainerException(
+                    f"Failed to pull docker image {image}: {'; '.join(errors) or 'image not found after pull'}"
+                )
+        _PRESENT_IMAGES.add(image)
+
+
+def _get_image_reference(algorithm: AlgorithmData) -> str:
+    """Get the docker image reference for the algorithm, pinned by digest if one is specified.
+
+    Args:
+        algorithm (AlgorithmData): The algorithm data
+
+    Returns:
+        str: The docker image reference
+    """
+    if algorithm.run_args.docker_image_digest:
+        # digest references are stored without tag (repo@digest) in the local image store
+        repository, _ = parse_repository_tag(algorithm.run_args.docker_image)
+        return f"{repository}@{algorithm.run_args.docker_image_digest}"
+    return algorithm.run_args.docker_image
 
 
+@lru_cache(maxsize=None)
 def _is_cuda_available() -> bool:
-    """Check if CUDA is available on the system by trying to run nvidia-smi."""
+    """Check if CUDA is available on the system by looking for the NVIDIA driver and otherwise trying to run nvidia-smi. The result is cached for the lifetime of the process."""
+    # a loaded NVIDIA kernel driver exposes its version here, which saves spawning nvidia-smi
+    if os.path.exists(_NVIDIA_DRIVER_VERSION_FILE):
+        return True
     try:
         # Attempt to run `nvidia-smi` to check for CUDA.
         # This command should run successfully if NVIDIA drivers are installed and GPUs are present.
@@ -116,7 +218,7 @@ def _handle_device_requests(
 
 
 def _get_additional_files_path(algorithm: AlgorithmData) -> Path:
-    """Get the path to the additional files for @algorithm.
+    """Get the path to the additional files for @algorithm. The check for the latest additional files runs once per record and process.
 
     Args:
         algorithm (AlgorithmData): The algorithm data
@@ -126,9 +228,13 @@ def _get_additional_files_path(algorithm: AlgorithmData) -> Path:
     """
     # ensure additional_files are present and get path
     if algorithm.additional_files is not None:
-        return check_additional_files_path(
-            record_id=algorithm.additional_files.record_id
-        )
+        record_id = algorithm.additional_files.record_id
+        with _ADDITIONAL_FILES_LOCK:
+            additional_files_path = _ADDITIONAL_FILES_PATHS.get(record_id)
+            if additional_files_path is None or not additional_files_path.exists():
+                additional_files_path = check_additional_files_path(record_id=record_id)
+                _ADDITIONAL_FILES_PATHS[record_id] = additional_files_path
+        return additional_files_path
     else:
         # if no additional_files are directly specified a dummy additional_files folder will be mounted
         return get_dummy_path()
@@ -151,15 +257,20 @@ def _get_volume_mappings(
     Returns:
         Dict: The volume mappings
     """
-    # TODO: add support for recommended "ro" mount mode for input data
     # data = mlcube_io0, additional files = mlcube_io1, output = mlcube_io2, parameters = mlcube_io3
+    # additional files and parameters are only read, the data folder stays writable since some algorithms create extra files in it
     return {
         volume.absolute(): {
             "bind": f"/mlcube_io{i}",
-            "mode": "rw",
+            "mode": mode,
         }
-        for i, volume in enumerate(
-            [data_path, additional_files_path, output_path, parameters_path]
+        for i, (volume, mode) in enumerate(
+            [
+                (data_path, "rw"),
+                (additional_files_path, "ro"),
+                (output_path, "rw"),
+                (parameters_path, "ro"),
+            ]
         )
     }
 
@@ -184,6 +295,20 @@ def _get_parameters_arg(algorithm: AlgorithmData) -> Optional[str]:
     return None
 
 
+def _check_shm_size(algorithm: AlgorithmData):
+    """Warn if the algorithm runs with a small private shared memory region, which can bottleneck multi-worker data loading.
+
+    Args:
+        algorithm (AlgorithmData): The algorithm data
+    """
+    if algorithm.run_args.ipc_mode == "host":
+        return
+    if parse_bytes(algorithm.run_args.shm_size) < parse_bytes("1g"):
+        logger.warning(
+            f"Shared memory size ({algorithm.run_args.shm_size}) is below 1g and the container uses a private IPC namespace. This might slow down or break data loading inside the container."
+        )
+
+
 def _build_args(
     algorithm: AlgorithmData,
 ) -> Tuple[str, str]:
@@ -213,29 +338,35 @@ def _build_args(
     if not algorithm.run_args.requires_root:
         # run the container as the current user to ensure written files are always owned by the user
         # also overall better security-wise
-        extra_args["user"] = f"{os.getuid()}:{os.getgid()}"
+        extra_args["user"] = _get_user()
 
     return command_args, extra_args
 
 
-def _observe_docker_output(container: docker.models.containers.Container) -> str:
+def _observe_docker_output(
+    container: docker.models.containers.Container, show_status: bool = True
+) -> str:
     """Observe the output of a running docker container and display a spinner. On Errors log container output.
 
     Args:
         container (docker.models.containers.Container): The container to observe
+        show_status (bool, optional): Whether to display the spinner. Defaults to True.
     """
-    # capture the output
-    container_output = container.attach(
-        stdout=True, stderr=True, stream=True, logs=True
+    # capture the output, the stream is drained in the background to avoid stalling the container on a full pipe
+    output_stream = container.attach(stdout=True, stderr=True, stream=True, logs=True)
+    output_chunks = []
+    reader = threading.Thread(
+        target=output_chunks.extend, args=(output_stream,), daemon=True
     )
+    reader.start()
 
     # Display spinner while the container is running
-    with Console().status("Running inference..."):
+    # rich supports only one live display at a time, concurrent callers show a shared status instead
+    with Console().status("Running inference...") if show_status else nullcontext():
         # Wait for the container to finish
         exit_code = container.wait()
-        container_output = "\n\r".join(
-            [line.decode("utf-8", errors="replace") for line in container_output]
-        )
+        reader.join()
+        container_output = b"".join(output_chunks).decode("utf-8", errors="replace")
         # Check if the container exited with an error
         if exit_code["StatusCode"] != 0:
             logger.error(f">> {container_output}")
@@ -275,8 +406,7 @@ def _sanity_check_output(
         )
 
     for i, output in enumerate(outputs, start=1):
-        content = nib.load(output).get_fdata()
-        if np.count_nonzero(content) == 0:
+        if not _has_nonzero_voxel(output):
             name = ""
             if internal_external_name_map is not None:
                 name_key = [
@@ -294,6 +424,23 @@ def _sanity_check_output(
             )
 
 
+def _has_nonzero_voxel(path: Path) -> bool:
+    """Check whether a NIfTI image contains at least one nonzero voxel.
+
+    Reads the image slice by slice in its native dtype and stops at the first nonzero slice,
+    instead of loading the whole volume as float64.
+
+    Args:
+        path (Path): Path to the NIfTI image
+
+    Returns:
+        bool: True if the image contains a nonzero voxel, False otherwise
+    """
+    # keep the file open so that consecutive slices of compressed images are read sequentially
+    img = nib.load(path, keep_file_open=True)
+    return any(np.any(np.asanyarray(img.dataobj[..., z])) for z in range(img.shape[-1]))
+
+
 def _log_algorithm_info(algorithm: AlgorithmData):
     """Log information about the algorithm.
 
@@ -306,7 +453,17 @@ def _log_algorithm_info(algorithm: AlgorithmData):
     logger.opt(colors=True).info(
         f"<blue>(Paper)</> Consider citing the corresponding paper: {algorithm.meta.paper} by {algorithm.meta.authors}"
     )
-    logger.debug(f"Docker image: {algorithm.run_args.docker_image}")
+    logger.debug("Docker image: {}", algorithm.run_args.docker_image)
+
+
+def prewarm_container(algorithm: AlgorithmData):
+    """Ensure the docker image and additional files of the provided algorithm are present, pulling / downloading them if required.
+
+    Args:
+        algorithm (AlgorithmData): The data of the algorithm to prepare
+    """
+    _ensure_image(image=_get_image_reference(algorithm=algorithm))
+    _get_additional_files_path(algorithm)
 
 
 def run_container(
@@ -316,6 +473,7 @@ def run_container(
     cuda_devices: str,
     force_cpu: bool,
     internal_external_name_map: Optional[Dict[str, str]] = None,
+    show_status: bool = True,
 ):
     """Run a docker container for the provided algorithm.
 
@@ -326,11 +484,13 @@ def run_container(
         cuda_devices (str): The CUDA devices to use
         force_cpu (bool): Whether to force CPU execution
         internal_external_name_map (Dict[str, str]): Dictionary mapping internal name (in standardized format) to external subject name provided by user (only used for batch inference)
+        show_status (bool, optional): Whether to display a spinner while the container is running, disable for concurrent runs. Defaults to True.
     """
     _log_algorithm_info(algorithm=algorithm)
 
     # ensure image is present, if not pull it
-    _ensure_image(image=algorithm.run_args.docker_image)
+    image = _get_image_reference(algorithm=algorithm)
+    _ensure_image(image=image)
 
     additional_files_path = _get_additional_files_path(algorithm)
 
@@ -343,22 +503,24 @@ def run_container(
         output_path=output_path,
         parameters_path=PARAMETERS_DIR,
     )
-    logger.debug(f"Volume mappings: {volume_mappings}")
+    logger.debug("Volume mappings: {}", volume_mappings)
 
     command_args, extra_args = _build_args(algorithm=algorithm)
-    logger.debug(f"Command args: {command_args}, Extra args: {extra_args}")
+    logger.debug("Command args: {}, Extra args: {}", command_args, extra_args)
 
     # device setup
     device_requests = _handle_device_requests(
         algorithm=algorithm, cuda_devices=cuda_devices, force_cpu=force_cpu
     )
-    logger.debug(f"GPU Device requests: {device_requests}")
+    logger.debug("GPU Device requests: {}", device_requests)
+
+    _check_shm_size(algorithm=algorithm)
 
     # Run the container
     logger.info(f"{'Starting inference'}")
     start_time = time.time()
     container = client.containers.run(
-        image=algorithm.run_args.docker_image,
+        image=image,
         volumes=volume_mappings,
         device_requests=device_requests,
         command=f"infer {command_args}",
@@ -366,9 +528,12 @@ def run_container(
         detach=True,
         remove=True,
         shm_size=algorithm.run_args.shm_size,
+        ipc_mode=algorithm.run_args.ipc_mode,
         **extra_args,
     )
-    container_output = _observe_docker_output(container=container)
+    container_output = _observe_docker_output(
+        container=container, show_status=show_status
+    )
     _sanity_check_output(
         data_path=data_path,
         output_path=output_path,
@@ -376,6 +541,7 @@ def run_container(
         internal_external_name_map=internal_external_name_map,
     )
 
-    logger.debug(f"Docker container output: \n\r{container_output}")
+    # formatted lazily, i.e. only if a handler accepts debug messages
+    logger.debug("Docker container output: \n\r{}", container_output)
 
     logger.info(f"Finished inference in {time.time() - start_time:.2f} seconds")
@@ -1,15 +1,14 @@
 from __future__ import annotations
 
 from pathlib import Path
-import shutil
 import sys
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from loguru import logger
 
 from brats.core.brats_algorithm import BraTSAlgorithm
 from brats.constants import INPAINTING_ALGORITHMS, InpaintingAlgorithms, Task
-from brats.utils.data_handling import input_sanity_check
+from brats.utils.data_handling import copy_file, input_sanity_check
 
 
 class Inpainter(BraTSAlgorithm):
@@ -47,15 +46,15 @@ class Inpainter(BraTSAlgorithm):
 
         subject_folder = data_folder / subject_id
         subject_folder.mkdir(parents=True, exist_ok=True)
-        # TODO: investigate usage of symlinks (might cause issues on windows and would probably require different volume handling)
+        # copies (not links) keep the user's files safe from algorithms writing to the mounted data folder
         t1n, mask = inputs["t1n"], inputs["mask"]
         try:
-            shutil.copy(
+            copy_file(
                 t1n,
                 subject_folder
                 / f"{subject_id}{subject_modality_separator}t1n-voided.nii.gz",
             )
-            shutil.copy(
+            copy_file(
                 mask,
                 subject_folder / f"{subject_id}{subject_modality_separator}mask.nii.gz",
             )
@@ -80,20 +79,19 @@ class Inpainter(BraTSAlgorithm):
             Dict[str, str]: Dictionary mapping internal name (in standardized format) to external subject name provided by user
         """
         internal_external_name_map = {}
+        subject_inputs = {}
         for i, subject in enumerate(subjects):
             internal_name = input_name_schema.format(id=i)
             internal_external_name_map[internal_name] = subject.name
             # TODO Add support for .nii files
+            subject_inputs[internal_name] = {
+                "t1n": subject / f"{subject.name}-t1n-voided.nii.gz",
+                "mask": subject / f"{subject.name}-mask.nii.gz",
+            }
 
-            self._standardize_single_inputs(
-                data_folder=data_folder,
-                subject_id=internal_name,
-                inputs={
-                    "t1n": subject / f"{subject.name}-t1n-voided.nii.gz",
-                    "mask": subject / f"{subject.name}-mask.nii.gz",
-                },
-                subject_modality_separator=self.algorithm.run_args.subject_modality_separator,
-            )
+        self._standardize_subjects(
+            data_folder=data_folder, subject_inputs=subject_inputs
+        )
         return internal_external_name_map
 
     def infer_single(
@@ -117,6 +115,25 @@ class Inpainter(BraTSAlgorithm):
             log_file=log_file,
         )
 
+    def infer_many(
+        self,
+        inputs: List[Dict[str, Path | str]],
+        output_files: List[Path | str],
+        log_file: Optional[Path | str] = None,
+    ) -> None:
+        """Perform inpainting on multiple subjects with a single container run and save each result to the respective output file.
+
+        Args:
+            inputs (List[Dict[str, Path | str]]): Images for each subject as dictionary with the keys "t1n" (voided T1n) and "mask"
+            output_files (List[Path | str]): Paths to save the inpainted images, one per subject
+            log_file (Path | str, optional): Save logs to this file
+        """
+        self._infer_many(
+            inputs=inputs,
+            output_files=output_files,
+            log_file=log_file,
+        )
+
     def infer_batch(
         self,
         data_folder: Path | str,
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 from pathlib import Path
-import shutil
 import sys
 from typing import Dict, List, Optional, Union
 
@@ -9,7 +8,7 @@ from loguru import logger
 
 from brats.core.brats_algorithm import BraTSAlgorithm
 from brats.constants import MISSING_MRI_ALGORITHMS, MissingMRIAlgorithms, Task
-from brats.utils.data_handling import input_sanity_check
+from brats.utils.data_handling import copy_file, input_sanity_check
 
 
 class MissingMRI(BraTSAlgorithm):
@@ -50,7 +49,7 @@ class MissingMRI(BraTSAlgorithm):
 
         try:
             for modality, path in inputs.items():
-                shutil.copy(
+                copy_file(
                     path,
                     subject_folder
                     / f"{subject_id}{subject_modality_separator}{modality}.nii.gz",
@@ -84,6 +83,7 @@ class MissingMRI(BraTSAlgorithm):
             Dict[str, str]: Dictionary mapping internal name (in standardized format) to external subject name provided by user
         """
         internal_external_name_map = {}
+        subject_inputs = {}
         for i, subject in enumerate(subjects):
             internal_name = input_name_schema.format(id=i)
             internal_external_name_map[internal_name] = subject.name
@@ -99,13 +99,11 @@ class MissingMRI(BraTSAlgorithm):
             assert (
                 len(valid_inputs) == 3
             ), "Exactly 3 inputs are required to perform synthesis of the missing modality"
+            subject_inputs[internal_name] = valid_inputs
 
-            self._standardize_single_inputs(
-                data_folder=data_folder,
-                subject_id=internal_name,
-                inputs=valid_inputs,
-                subject_modality_separator=self.algorithm.run_args.subject_modality_separator,
-            )
+        self._standardize_subjects(
+            data_folder=data_folder, subject_inputs=subject_inputs
+        )
         return internal_external_name_map
 
     def infer_single(
@@ -147,6 +145,34 @@ class MissingMRI(BraTSAlgorithm):
             log_file=log_file,
         )
 
+    def infer_many(
+        self,
+        inputs: List[Dict[str, Path | str]],
+        output_files: List[Path | str],
+        log_file: Optional[Path | str] = None,
+    ) -> None:
+        """
+        Perform synthesis of the missing modality for multiple subjects with a single container run and save each result to the respective output file.
+
+        Note:
+            Exactly 3 input modalities are required per subject to perform synthesis of the missing modality.
+
+        Args:
+            inputs (List[Dict[str, Path | str]]): Images for each subject as dictionary with 3 of the keys "t1c", "t1n", "t2f" and "t2w"
+            output_files (List[Path | str]): Paths to save the synthesized images, one per subject
+            log_file (Optional[Path | str], optional): Save logs to this file. Defaults to None
+        """
+        for subject_inputs in inputs:
+            assert (
+                len(subject_inputs) == 3
+            ), "Exactly 3 inputs are required to perform synthesis of the missing modality"
+
+        self._infer_many(
+            inputs=inputs,
+            output_files=output_files,
+            log_file=log_file,
+        )
+
     def infer_batch(
         self,
         data_folder: Path | str,
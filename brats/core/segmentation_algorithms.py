@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import shutil
 import sys
 from pathlib import Path
 from typing import Dict, List, Optional, Union
@@ -24,7 +23,7 @@ from brats.constants import (
     PediatricAlgorithms,
     Task,
 )
-from brats.utils.data_handling import input_sanity_check
+from brats.utils.data_handling import copy_file, input_sanity_check
 
 
 class SegmentationAlgorithm(BraTSAlgorithm):
@@ -70,10 +69,10 @@ class SegmentationAlgorithm(BraTSAlgorithm):
 
         subject_folder = data_folder / subject_id
         subject_folder.mkdir(parents=True, exist_ok=True)
-        # TODO: investigate usage of symlinks (might cause issues on windows and would probably require different volume handling)
+        # copies (not links) keep the user's files safe from algorithms writing to the mounted data folder
         try:
             for modality, path in inputs.items():
-                shutil.copy(
+                copy_file(
                     path,
                     subject_folder
                     / f"{subject_id}{subject_modality_separator}{modality}.nii.gz",
@@ -112,6 +111,7 @@ class SegmentationAlgorithm(BraTSAlgorithm):
             Dict[str, str]: Dictionary mapping internal name (in standardized format) to external subject name provided by user
         """
         internal_external_name_map = {}
+        subject_inputs = {}
         for i, subject in enumerate(subjects):
             internal_name = input_name_schema.format(id=i)
             internal_external_name_map[internal_name] = subject.name
@@ -123,13 +123,11 @@ class SegmentationAlgorithm(BraTSAlgorithm):
                 inputs["t1n"] = subject / f"{subject.name}-t1n.nii.gz"
                 inputs["t2f"] = subject / f"{subject.name}-t2f.nii.gz"
                 inputs["t2w"] = subject / f"{subject.name}-t2w.nii.gz"
+            subject_inputs[internal_name] = inputs
 
-            self._standardize_single_inputs(
-                data_folder=data_folder,
-                subject_id=internal_name,
-                inputs=inputs,
-                subject_modality_separator=self.algorithm.run_args.subject_modality_separator,
-            )
+        self._standardize_subjects(
+            data_folder=data_folder, subject_inputs=subject_inputs
+        )
         return internal_external_name_map
 
     def infer_single(
@@ -157,6 +155,25 @@ class SegmentationAlgorithm(BraTSAlgorithm):
             log_file=log_file,
         )
 
+    def infer_many(
+        self,
+        inputs: List[Dict[str, Path | str]],
+        output_files: List[Path | str],
+        log_file: Optional[Path | str] = None,
+    ) -> None:
+        """Perform segmentation on multiple subjects with a single container run and save each result to the respective output file.
+
+        Args:
+            inputs (List[Dict[str, Path | str]]): Images for each subject as dictionary with the keys "t1c", "t1n", "t2f" and "t2w"
+            output_files (List[Path | str]): Paths to save the segmentations, one per subject
+            log_file (Path | str, optional): Save logs to this file
+        """
+        self._infer_many(
+            inputs=inputs,
+            output_files=output_files,
+            log_file=log_file,
+        )
+
     def infer_batch(
         self,
         data_folder: Path | str,
@@ -311,6 +328,47 @@ class MeningiomaSegmenter(SegmentationAlgorithm):
         # filter out None values
         inputs = {k: v for k, v in inputs.items() if v is not None}
 
+        self._validate_inputs(inputs=inputs)
+        self._infer_single(
+            inputs=inputs,
+            output_file=output_file,
+            log_file=log_file,
+        )
+
+    def infer_many(
+        self,
+        inputs: List[Dict[str, Path | str]],
+        output_files: List[Path | str],
+        log_file: Optional[Path | str] = None,
+    ) -> None:
+        """Perform segmentation on multiple subjects with a single container run and save each result to the respective output file.
+
+        Note:
+            The required modalities differ by year, see :meth:`infer_single`.
+
+        Args:
+            inputs (List[Dict[str, Path | str]]): Images for each subject as dictionary with the keys "t1c" (2024) or "t1c", "t1n", "t2f" and "t2w" (2023)
+            output_files (List[Path | str]): Paths to save the segmentations, one per subject
+            log_file (Path | str, optional): Save logs to this file
+        """
+        for subject_inputs in inputs:
+            self._validate_inputs(inputs=subject_inputs)
+        self._infer_many(
+            inputs=inputs,
+            output_files=output_files,
+            log_file=log_file,
+        )
+
+    def _validate_inputs(self, inputs: Dict[str, Path | str]) -> None:
+        """Check that exactly the modalities required by the algorithm's challenge year are provided.
+
+        Args:
+            inputs (Dict[str, Path | str]): Dictionary with the input images
+
+        Raises:
+            ValueError: If the provided modalities do not match the requirements
+            NotImplementedError: If the algorithm's year is not supported
+        """
         year = self.algorithm.meta.year
         if year == 2024:
             if "t1c" not in inputs or len(inputs) > 1:
@@ -332,11 +390,6 @@ class MeningiomaSegmenter(SegmentationAlgorithm):
             raise NotImplementedError(
                 f"Invalid algorithm {year=} .Only 2023 and 2024 are supported as of now"
             )
-        self._infer_single(
-            inputs=inputs,
-            output_file=output_file,
-            log_file=log_file,
-        )
 
     def infer_batch(
         self,
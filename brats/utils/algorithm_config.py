@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional
 from brats.utils.exceptions import AlgorithmConfigException
@@ -6,6 +7,12 @@ from brats.utils.exceptions import AlgorithmConfigException
 import yaml
 from dacite import DaciteError, from_dict
 
+try:
+    # libyaml based loader is considerably faster if available
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 
 @dataclass
 class MetaData:
@@ -37,10 +44,14 @@ class RunArgs:
     """Whether the Docker container requires root access. This is !discouraged! but some submission do not work without it"""
     shm_size: Optional[str] = "2gb"
     """The required shared memory size for the Docker container"""
+    ipc_mode: Optional[str] = None
+    """The IPC mode for the Docker container. 'host' shares the host's IPC namespace (and /dev/shm), avoiding shm bottlenecks of multi-worker data loaders at the cost of weaker isolation. Defaults to a private namespace sized by shm_size"""
     cpu_compatible: Optional[bool] = False
     """Whether the algorithm is compatible with CPU"""
     subject_modality_separator: Optional[str] = "-"
     """The separator between the subject ID and the modality, differs e.g. for BraTS24 Meningioma Challenge"""
+    docker_image_digest: Optional[str] = None
+    """Optional content digest (e.g. sha256:...) to pin the Docker image content independent of its tag. Once pulled, a pinned image is resolved locally without contacting the registry"""
 
 
 @dataclass
@@ -73,7 +84,7 @@ class AlgorithmList:
 
 
 def load_algorithms(file_path: Path) -> Dict[str, AlgorithmData]:
-    """Load the algorithms data from the specified yaml file
+    """Load the algorithms data from the specified yaml file. Results are cached per file for the lifetime of the process, i.e. the returned data is shared and should not be modified.
 
     Params:
         file_path (str): The path to the yaml file
@@ -81,12 +92,25 @@ def load_algorithms(file_path: Path) -> Dict[str, AlgorithmData]:
     Raises:
         FileNotFoundError: If the file is not found
 
+    Returns:
+        Dict[str, AlgorithmData]: Dict of algorithm @AlgorithmKeys:@AlgorithmData  pairs
+    """
+    return _load_algorithms(file_path=str(Path(file_path).resolve()))
+
+
+@lru_cache(maxsize=None)
+def _load_algorithms(file_path: str) -> Dict[str, AlgorithmData]:
+    """Parse the algorithms data from the yaml file at the resolved @file_path (cached).
+
+    Params:
+        file_path (str): The resolved path to the yaml file
+
     Returns:
         Dict[str, AlgorithmData]: Dict of algorithm @AlgorithmKeys:@AlgorithmData  pairs
     """
     try:
         with open(file_path, "r") as file:
-            data = yaml.safe_load(file)
+            data = yaml.load(file.read(), Loader=_YamlLoader)
     except FileNotFoundError:
         raise FileNotFoundError("Algorithm meta data file not found")
 
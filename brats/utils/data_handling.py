@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import errno
+import gzip
+import os
 import shutil
+import struct
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from typing import Generator, Optional, Tuple
+from typing import Generator, List, Optional, Tuple
 
-import nibabel as nib
 from loguru import logger
 
+from brats.utils.lazy_import import lazy_import
+
+# only required to check inputs that are not plain NIfTI-1, loaded on first use to keep the package import fast
+nib = lazy_import("nibabel")
+
+_NIFTI1_HEADER_SIZE = 348
+_MAX_REMOVAL_WORKERS = 8
+
 
 def remove_tmp_folder(folder: Path):
     """Remove a temporary folder and log a warning if it fails.
@@ -17,6 +30,19 @@ def remove_tmp_folder(folder: Path):
         folder (Path): Path to the folder to be removed
     """
     try:
+        # subject folders are independent, removing them concurrently overlaps the per-entry syscalls of large batches
+        with os.scandir(folder) as entries:
+            sub_folders = [e.path for e in entries if e.is_dir(follow_symlinks=False)]
+        if len(sub_folders) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(_MAX_REMOVAL_WORKERS, len(sub_folders))
+            ) as executor:
+                # errors surface in the final removal below
+                list(
+                    executor.map(
+                        partial(shutil.rmtree, ignore_errors=True), sub_folders
+                    )
+                )
         shutil.rmtree(folder)
     except PermissionError as e:
         logger.warning(
@@ -26,6 +52,89 @@ def remove_tmp_folder(folder: Path):
         logger.warning(f"Failed to delete folder {folder}. {e}")
 
 
+def clear_tmp_folder(folder: Path):
+    """Remove the contents of a temporary folder but keep the folder itself and log a warning if it fails.
+
+    Args:
+        folder (Path): Path to the folder to be cleared
+    """
+    for entry in folder.iterdir():
+        if entry.is_dir() and not entry.is_symlink():
+            remove_tmp_folder(entry)
+            continue
+        try:
+            entry.unlink()
+        except PermissionError as e:
+            logger.warning(
+                f"Failed to remove temporary file {entry}. This is most likely caused by bad permission management of the docker container. \nError: {e}"
+            )
+
+
+def copy_file(src: Path | str, dst: Path | str):
+    """Copy the content of a file in kernel space with copy_file_range (allows reflinks on e.g. XFS/Btrfs), falling back to shutil.copyfile where it is not supported.
+
+    Args:
+        src (Path | str): Path to the source file
+        dst (Path | str): Destination path (overwritten if it exists)
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                return
+        except OSError as e:
+            if e.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+            ):
+                raise
+    # shutil.copyfile itself uses sendfile on Linux
+    shutil.copyfile(src, dst)
+
+
+def move_file(src: Path | str, dst: Path | str):
+    """Move a file with a single rename if possible, falling back to copy and delete across file systems.
+
+    Args:
+        src (Path | str): Path to the file to be moved
+        dst (Path | str): Destination path (overwritten if it exists)
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def find_subject_folders(data_folder: Path | str) -> List[Path]:
+    """Find the subject folders in the data folder, sorted by name so the subject order is deterministic.
+    Hidden folders (e.g. temporary output folders of killed runs) are skipped.
+
+    Args:
+        data_folder (Path | str): Folder containing one folder per subject
+
+    Returns:
+        List[Path]: Subject folders
+    """
+    # scandir provides the file type from the directory listing without an extra stat call per entry
+    with os.scandir(data_folder) as entries:
+        folders = [
+            entry
+            for entry in entries
+            if not entry.name.startswith(".") and entry.is_dir()
+        ]
+    return [Path(entry.path) for entry in sorted(folders, key=lambda e: e.name)]
+
+
 def add_log_file_handler(log_file: Path | str) -> int:
     """
     Add a log file handler to the logger.
@@ -48,9 +157,21 @@ def add_log_file_handler(log_file: Path | str) -> int:
 @contextmanager
 def InferenceSetup(
     log_file: Optional[Path | str] = None,
+    tmp_output_parent: Optional[Path | str] = None,
+    tmp_data_folder: Optional[Path] = None,
 ) -> Generator[Tuple[Path, Path], None, None]:
     """
     Context manager for setting up the inference process. Creates temporary data and output folders and adds a log file handler if requested.
+    The inputs are copied into the data folder, which is created in the system temp directory. It is not placed in /dev/shm by default
+    since staged batches can exceed its size and containers with ipc_mode "host" share it. Set TMPDIR (e.g. to /dev/shm) to stage inputs elsewhere.
+
+    Args:
+        log_file (Optional[Path | str], optional): Log file with extra information. Defaults to None.
+        tmp_data_folder (Optional[Path], optional): Existing (empty) data folder to use instead of creating one. It is left in place, its owner is responsible for clearing and removing it.
+            Defaults to None.
+        tmp_output_parent (Optional[Path | str], optional): Existing folder in which the temporary output folder is created.
+            Placing it next to the final destination keeps both on the same file system so outputs can be renamed instead of copied.
+            The folder is hidden and named .brats_output_* so leftovers of killed processes are recognizable. Defaults to None (system temp directory).
 
     Yields:
         (data folder, output folder) (Tuple[Path, Path]): Two temporary folders (data folder, output folder)
@@ -58,19 +179,50 @@ def InferenceSetup(
     if log_file is not None:
         logger_id = add_log_file_handler(log_file)
 
-    tmp_data_folder = Path(tempfile.mkdtemp(prefix="data_"))
-    tmp_output_folder = Path(tempfile.mkdtemp(prefix="output_"))
+    owns_data_folder = tmp_data_folder is None
+    if owns_data_folder:
+        tmp_data_folder = Path(tempfile.mkdtemp(prefix="data_"))
+    tmp_output_folder = Path(
+        tempfile.mkdtemp(
+            prefix="output_" if tmp_output_parent is None else ".brats_output_",
+            dir=tmp_output_parent,
+        )
+    )
 
     try:
         yield tmp_data_folder, tmp_output_folder
     finally:
-        remove_tmp_folder(tmp_data_folder)
+        if owns_data_folder:
+            remove_tmp_folder(tmp_data_folder)
         remove_tmp_folder(tmp_output_folder)
 
         if log_file is not None:
             logger.remove(logger_id)
 
 
+def _read_nifti_shape(path: Path | str) -> Tuple[int, ...]:
+    """Read the image shape from the NIfTI-1 header without constructing a nibabel image, falling back to nibabel for other formats.
+
+    Args:
+        path (Path | str): Path to the NIfTI image (optionally gzip compressed)
+
+    Returns:
+        Tuple[int, ...]: Shape of the image
+    """
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rb") as f:
+        header = f.read(_NIFTI1_HEADER_SIZE)
+    if len(header) == _NIFTI1_HEADER_SIZE:
+        # sizeof_hdr is 348 in the byte order of the file
+        for endianness in "<>":
+            if struct.unpack(f"{endianness}i", header[:4])[0] == _NIFTI1_HEADER_SIZE:
+                dim = struct.unpack(f"{endianness}8h", header[40:56])
+                if 1 <= dim[0] <= 7:
+                    return tuple(dim[1 : dim[0] + 1])
+    # the shape comes from the header, mmap only adds setup cost
+    return nib.load(path, mmap=False).shape
+
+
 def input_sanity_check(
     t1n: Optional[Path | str] = None,
     t1c: Optional[Path | str] = None,
@@ -101,7 +253,9 @@ def input_sanity_check(
 
     # Load and check shapes
     shapes = {
-        label: nib.load(img).shape for label, img in images.items() if img is not None
+        label: _read_nifti_shape(img)
+        for label, img in images.items()
+        if img is not None
     }
 
     assert shapes, "No input images provided. At least one image is required."
@@ -110,7 +264,7 @@ def input_sanity_check(
         logger.warning(
             "Input images do not have the default shape (240, 240, 155). This might cause issues with some algorithms and could lead to errors."
         )
-        logger.warning(f"Image shapes: {shapes}")
+        logger.warning("Image shapes: {}", shapes)
         logger.warning(
             "If your data is not preprocessed yet, consider using our preprocessing package: https://github.com/BrainLesion/preprocessing"
         )
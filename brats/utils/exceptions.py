@@ -17,3 +17,9 @@ class AlgorithmConfigException(DaciteError):
     """Exception raised when the algorithm config file has issues."""
 
     pass
+
+
+class ZenodoException(Exception):
+    """Exception raised when additional files can not be fetched from Zenodo."""
+
+    pass
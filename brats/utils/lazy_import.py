@@ -0,0 +1,38 @@
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Import a module lazily, i.e. the module is only executed on first attribute access.
+    Used for heavy dependencies that are not required until inference to keep the package import fast.
+
+    Args:
+        name (str): Name of the module to import
+
+    Returns:
+        ModuleType: The (lazily loaded) module
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def force_load(module: ModuleType) -> None:
+    """Execute a lazily imported module now if it was not loaded yet.
+    importlib's LazyLoader is not thread-safe before Python 3.12, so modules used by worker threads have to be loaded before the threads are started.
+
+    Args:
+        module (ModuleType): The (lazily loaded) module
+    """
+    # any attribute access triggers the deferred execution
+    getattr(module, "__name__")
@@ -1,27 +1,51 @@
 from __future__ import annotations
 
+import json
+import os
 import shutil
-import sys
+import tempfile
+import threading
+import time
 import zipfile
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from rich.progress import Progress, SpinnerColumn, TextColumn
 
 from brats.constants import ADDITIONAL_FILES_FOLDER, ZENODO_RECORD_BASE_URL
-
-
+from brats.utils.exceptions import ZenodoException
+
+# written to a record folder once its additional files were completely downloaded and extracted
+VERIFIED_MARKER = ".verified"
+# Zenodo record metadata is cached on disk to avoid a network round trip for every inference call
+METADATA_CACHE_FILE = ".zenodo_metadata.json"
+METADATA_CACHE_TTL = 60 * 60  # seconds
+_MAX_EXTRACTION_WORKERS = 8
+# required free disk space relative to the archive size
+_DISK_SPACE_FACTOR = 2
+# (connect, read) timeouts in seconds, the read timeout applies per received chunk for streamed downloads
+_REQUEST_TIMEOUT = (10, 60)
+# set to "1" to check Zenodo for newer versions of already downloaded additional files
+CHECK_UPDATES_ENV_VAR = "BRATS_CHECK_UPDATES"
+
+
+@lru_cache(maxsize=None)
 def get_dummy_path() -> Path:
+    # the folder only has to be created once per process
     dummy = ADDITIONAL_FILES_FOLDER / "dummy"
     dummy.mkdir(exist_ok=True, parents=True)
     return dummy
 
 
 def check_additional_files_path(record_id: str) -> Path:
-    """Check if latest additional files are present and download them otherwise.
+    """Check if additional files are present locally and download them otherwise.
+    Zenodo is only queried for newer versions of locally present files if the environment variable BRATS_CHECK_UPDATES is set to 1.
 
     Args:
         record_id (str): Zenodo record ID.
@@ -30,26 +54,41 @@ def check_additional_files_path(record_id: str) -> Path:
         Path: Path to the additional files folder.
     """
 
-    zenodo_metadata, archive_url = _get_zenodo_metadata_and_archive_url(
-        record_id=record_id
-    )
-
-    record_additional_files_pattern = f"{record_id}_v*.*.*"
-    matching_folders = list(
-        ADDITIONAL_FILES_FOLDER.glob(record_additional_files_pattern)
-    )
+    matching_folders = _find_record_folders(record_id=record_id)
     # Get the latest downloaded additional_files
     latest_downloaded_additional_files = _get_latest_version_folder_name(
         matching_folders
     )
 
+    if (
+        latest_downloaded_additional_files
+        and os.environ.get(CHECK_UPDATES_ENV_VAR) != "1"
+    ):
+        # skip the Zenodo round trip, local files are used as is
+        logger.info(
+            "Found downloaded local additional_files: {}",
+            latest_downloaded_additional_files,
+        )
+        return ADDITIONAL_FILES_FOLDER / latest_downloaded_additional_files
+
+    try:
+        zenodo_metadata, archive_url = _get_zenodo_metadata_and_archive_url(
+            record_id=record_id
+        )
+    except ZenodoException as e:
+        if not latest_downloaded_additional_files:
+            raise ZenodoException(
+                f"Additional files for record_id '{record_id}' not found locally and Zenodo could not be reached: {e}"
+            ) from e
+        logger.warning(
+            "Zenodo server could not be reached ({}). Using the latest downloaded additional files: {}",
+            e,
+            latest_downloaded_additional_files,
+        )
+        return ADDITIONAL_FILES_FOLDER / latest_downloaded_additional_files
+
     if not latest_downloaded_additional_files:
-        if not zenodo_metadata:
-            logger.error(
-                "Additional files not found locally and Zenodo could not be reached. Exiting..."
-            )
-            sys.exit()
-        logger.info(f"Additional files not found locally")
+        logger.info("Additional files not found locally")
 
         return _download_additional_files(
             zenodo_metadata=zenodo_metadata,
@@ -58,30 +97,27 @@ def check_additional_files_path(record_id: str) -> Path:
         )
 
     logger.info(
-        f"Found downloaded local additional_files: {latest_downloaded_additional_files}"
+        "Found downloaded local additional_files: {}",
+        latest_downloaded_additional_files,
     )
 
-    if not zenodo_metadata:
-        logger.warning(
-            "Zenodo server could not be reached. Using the latest downloaded additional files."
-        )
-        return ADDITIONAL_FILES_FOLDER / latest_downloaded_additional_files
-
     # Compare the latest downloaded additional files with the latest Zenodo version
     if zenodo_metadata["version"] == latest_downloaded_additional_files.split("_v")[1]:
         logger.info(
-            f"Latest additional files ({latest_downloaded_additional_files}) are already present."
+            "Latest additional files ({}) are already present.",
+            latest_downloaded_additional_files,
         )
         return ADDITIONAL_FILES_FOLDER / latest_downloaded_additional_files
 
     logger.info(
-        f"New additional files available on Zenodo ({zenodo_metadata['version']}). Deleting old and fetching new additional files..."
+        "New additional files available on Zenodo ({}). Deleting old and fetching new additional files...",
+        zenodo_metadata["version"],
     )
     # delete old additional files
     shutil.rmtree(
         ADDITIONAL_FILES_FOLDER / latest_downloaded_additional_files,
         onerror=lambda func, path, excinfo: logger.warning(
-            f"Failed to delete {path}: {excinfo}"
+            "Failed to delete {}: {}", path, excinfo
         ),
     )
     return _download_additional_files(
@@ -89,6 +125,30 @@ def check_additional_files_path(record_id: str) -> Path:
     )
 
 
+def _find_record_folders(record_id: str) -> List[Path]:
+    """Find the downloaded version folders (named {record_id}_v{major}.{minor}.{patch}) of the Zenodo record.
+
+    Args:
+        record_id (str): Zenodo record ID.
+
+    Returns:
+        List[Path]: Version folders of the record.
+    """
+    prefix = f"{record_id}_v"
+    try:
+        # scandir provides the file type from the directory listing, no stat call or glob pattern compilation per lookup
+        with os.scandir(ADDITIONAL_FILES_FOLDER) as entries:
+            return [
+                Path(entry.path)
+                for entry in entries
+                if entry.name.startswith(prefix)
+                and entry.name[len(prefix) :].count(".") >= 2
+                and entry.is_dir()
+            ]
+    except FileNotFoundError:
+        return []
+
+
 def _get_latest_version_folder_name(folders: List[Path]) -> str | None:
     """Get the latest (non empty) version folder name from the list of folders.
 
@@ -100,36 +160,131 @@ def _get_latest_version_folder_name(folders: List[Path]) -> str | None:
     """
     if not folders:
         return None
-    latest_downloaded_folder = sorted(
+    latest_downloaded_folder = max(
         folders,
-        reverse=True,
-        key=lambda x: tuple(map(int, str(x).split("_v")[1].split("."))),
-    )[0]
-    # check folder is not empty
-    if not list(latest_downloaded_folder.glob("*")):
+        key=lambda x: tuple(map(int, x.name.split("_v", 1)[1].split("."))),
+    )
+    if not _is_complete_record_folder(latest_downloaded_folder):
         return None
     return latest_downloaded_folder.name
 
 
-def _get_zenodo_metadata_and_archive_url(record_id: str) -> Dict | None:
-    """Get the metadata for the Zenodo record and the files archive url.
+def _is_complete_record_folder(folder: Path) -> bool:
+    """Check if the record folder holds completely downloaded additional files.
+
+    Args:
+        folder (Path): Record folder named {record_id}_v{version}.
 
     Returns:
-        Tuple: (dict: Metadata for the Zenodo record, str: URL to the archive file)
+        bool: True if the folder's verified marker matches its record id and version or, for folders downloaded before markers were written, if it is non empty and contains no partial download.
     """
+    record_id, version = folder.name.split("_v", 1)
     try:
-        response = requests.get(f"{ZENODO_RECORD_BASE_URL}/{record_id}")
-        if response.status_code != 200:
-            logger.error(
-                f"Cant find additional files for record_id '{record_id}' on Zenodo. Exiting..."
-            )
-            # TODO add proper exit exception
-        data = response.json()
-        return data["metadata"], data["links"]["archive"]
+        return (folder / VERIFIED_MARKER).read_text() == f"{record_id}\n{version}"
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries]
+    return bool(names) and not any(name.endswith(".part") for name in names)
+
+
+@lru_cache(maxsize=None)
+def _get_session() -> requests.Session:
+    """Get the HTTP session shared by all Zenodo requests (created on first use).
+    Reusing the session keeps connections alive, avoiding a TCP and TLS handshake per request. Transient failures are retried with backoff.
+
+    Returns:
+        requests.Session: The shared session
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+    )
+    session.mount("https://", HTTPAdapter(max_retries=retries))
+    return session
+
+
+def _load_cached_metadata(record_id: str) -> Tuple[Dict, str] | None:
+    """Load the cached metadata and archive url for the Zenodo record if they are not expired.
+
+    Args:
+        record_id (str): Zenodo record ID.
+
+    Returns:
+        Tuple[Dict, str] | None: (Metadata for the Zenodo record, URL to the archive file) if cached, else None.
+    """
+    try:
+        with open(ADDITIONAL_FILES_FOLDER / METADATA_CACHE_FILE, "r") as f:
+            entry = json.load(f)[record_id]
+        if time.time() - entry["fetched_at"] < METADATA_CACHE_TTL:
+            return entry["metadata"], entry["archive_url"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _cache_metadata(record_id: str, metadata: Dict, archive_url: str) -> None:
+    """Store the metadata and archive url for the Zenodo record in the on-disk cache.
+
+    Args:
+        record_id (str): Zenodo record ID.
+        metadata (Dict): Metadata for the Zenodo record.
+        archive_url (str): URL to the archive file.
+    """
+    cache_file = ADDITIONAL_FILES_FOLDER / METADATA_CACHE_FILE
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[record_id] = {
+        "metadata": metadata,
+        "archive_url": archive_url,
+        "fetched_at": time.time(),
+    }
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file and rename so concurrent readers never see a partial file
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}")
+        tmp_file.write_text(json.dumps(cache))
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.debug("Failed to cache Zenodo metadata: {}", e)
+
+
+def _get_zenodo_metadata_and_archive_url(record_id: str) -> Tuple[Dict, str]:
+    """Get the metadata for the Zenodo record and the files archive url. Responses are cached on disk for METADATA_CACHE_TTL seconds.
+    The cache is bypassed if the environment variable BRATS_CHECK_UPDATES is set to 1, since that explicitly asks for the latest metadata.
 
+    Returns:
+        Tuple: (dict: Metadata for the Zenodo record, str: URL to the archive file)
+
+    Raises:
+        ZenodoException: If the record can not be found or Zenodo can not be reached
+    """
+    if os.environ.get(CHECK_UPDATES_ENV_VAR) != "1":
+        cached = _load_cached_metadata(record_id=record_id)
+        if cached:
+            return cached
+    try:
+        response = _get_session().get(
+            f"{ZENODO_RECORD_BASE_URL}/{record_id}", timeout=_REQUEST_TIMEOUT
+        )
     except requests.exceptions.RequestException as e:
-        logger.warning(f"Failed to fetch Zenodo metadata: {e}")
-        return None
+        raise ZenodoException(f"Failed to fetch Zenodo metadata: {e}") from e
+    if response.status_code != 200:
+        raise ZenodoException(
+            f"Cant find additional files for record_id '{record_id}' on Zenodo. Status code: {response.status_code}"
+        )
+    data = response.json()
+    metadata, archive_url = data["metadata"], data["links"]["archive"]
+    _cache_metadata(record_id=record_id, metadata=metadata, archive_url=archive_url)
+    return metadata, archive_url
 
 
 def _download_additional_files(
@@ -144,64 +299,193 @@ def _download_additional_files(
 
     Returns:
         Path: Path to the additional files folder for the requested record.
+
+    Raises:
+        ZenodoException: If the download fails or there is not enough disk space
     """
     record_folder = (
         ADDITIONAL_FILES_FOLDER / f"{record_id}_v{zenodo_metadata['version']}"
     )
     # ensure folder exists
-    record_folder.mkdir(parents=True, exist_ok=True)
+    ADDITIONAL_FILES_FOLDER.mkdir(parents=True, exist_ok=True)
 
-    logger.info(f"Downloading additional files from Zenodo. This might take a while...")
+    logger.info("Downloading additional files from Zenodo. This might take a while...")
     # Make a GET request to the URL
-    response = requests.get(archive_url, stream=True)
-    # Ensure the request was successful
-    if response.status_code != 200:
-        logger.error(
-            f"Failed to download additional files. Status code: {response.status_code}"
+    response = _get_session().get(archive_url, stream=True, timeout=_REQUEST_TIMEOUT)
+    # the streamed response holds a pooled connection until it is closed
+    try:
+        # Ensure the request was successful
+        if response.status_code != 200:
+            raise ZenodoException(
+                f"Failed to download additional files. Status code: {response.status_code}"
+            )
+        _check_disk_space(response=response, folder=ADDITIONAL_FILES_FOLDER)
+
+        # download and extract into a hidden staging folder that is only renamed to the record folder once complete,
+        # a killed process can therefore never leave a partial record folder behind
+        staging_folder = Path(
+            tempfile.mkdtemp(
+                dir=ADDITIONAL_FILES_FOLDER, prefix=f".{record_folder.name}."
+            )
         )
-        return
+        try:
+            _extract_archive(response=response, record_folder=staging_folder)
+            (staging_folder / VERIFIED_MARKER).write_text(
+                f"{record_id}\n{zenodo_metadata['version']}"
+            )
+            if record_folder.exists():
+                # leftover of an incomplete download, complete folders are never downloaded again
+                shutil.rmtree(record_folder)
+            os.replace(staging_folder, record_folder)
+        except BaseException:
+            shutil.rmtree(staging_folder, ignore_errors=True)
+            raise
+    finally:
+        response.close()
+
+    logger.info("Zip file extracted successfully to {}", record_folder)
+    return record_folder
 
-    _extract_archive(response=response, record_folder=record_folder)
 
-    logger.info(f"Zip file extracted successfully to {record_folder}")
-    return record_folder
+def _check_disk_space(response: requests.Response, folder: Path) -> None:
+    """Check if the folder's file system can hold the archive announced by the response headers (before its body is downloaded).
+
+    Args:
+        response (requests.Response): The streamed archive response
+        folder (Path): The folder the archive will be downloaded and extracted to
+
+    Raises:
+        ZenodoException: If the archive size is known and exceeds the available space
+    """
+    archive_size = response.headers.get("Content-Length")
+    if archive_size is None:
+        return
+    # the downloaded archive and the extracted files coexist until the archive is removed
+    required = int(archive_size) * _DISK_SPACE_FACTOR
+    free = shutil.disk_usage(folder).free
+    if free < required:
+        raise ZenodoException(
+            f"Not enough disk space to download additional files to {folder}: {required / 1024**3:.2f} GB required, {free / 1024**3:.2f} GB available"
+        )
 
 
 def _extract_archive(response: requests.Response, record_folder: Path):
+    """Download the archive from the streamed response and extract it to the record folder.
+
+    Args:
+        response (requests.Response): The streamed archive response
+        record_folder (Path): The folder to extract the archive to (the archive is temporarily stored here as well)
+
+    Raises:
+        ZenodoException: If the download is incomplete
+    """
     # Download with progress bar
-    chunk_size = 1024  # 1KB
-    bytes_io = BytesIO()
-
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[cyan]Downloading additional files..."),
-        TextColumn("[cyan]{task.completed:.2f} MB"),
-        transient=True,
-    ) as progress:
-        task = progress.add_task("", total=None)  # Indeterminate progress
-
-        for data in response.iter_content(chunk_size=chunk_size):
-            bytes_io.write(data)
-            progress.update(
-                task, advance=len(data) / (chunk_size**2)
-            )  # Convert bytes to MB
-
-    # Extract the downloaded zip file to the target folder
-    with zipfile.ZipFile(bytes_io) as zip_ref:
-        zip_ref.extractall(record_folder)
-
-    # check if the extracted file is still a zip
-    for f in record_folder.iterdir():
-        if f.is_file() and f.suffix == ".zip":
-            with zipfile.ZipFile(f) as zip_ref:
-                files = zip_ref.namelist()
-                with Progress(transient=True) as progress:
-                    task = progress.add_task(
-                        "[cyan]Extracting files...", total=len(files)
-                    )
-                    # Iterate over the files and extract them
-                    for i, file in enumerate(files):
-                        zip_ref.extract(file, record_folder)
-                        # Update the progress bar
-                        progress.update(task, completed=i + 1)
-            f.unlink()  # remove zip after extraction
+    # larger chunks keep the per chunk python overhead negligible
+    chunk_size = 1024 * 1024  # 1MB
+
+    # stream the archive to disk instead of memory, archives can be several GB large
+    with tempfile.NamedTemporaryFile(
+        dir=record_folder, suffix=".zip.part", delete=False
+    ) as archive_file:
+        archive_path = Path(archive_file.name)
+        try:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[cyan]Downloading additional files..."),
+                TextColumn("[cyan]{task.completed:.2f} MB"),
+                transient=True,
+            ) as progress:
+                task = progress.add_task("", total=None)  # Indeterminate progress
+
+                downloaded = 0
+                for data in response.iter_content(
+                    chunk_size=chunk_size, decode_unicode=False
+                ):
+                    archive_file.write(data)
+                    downloaded += len(data)
+                    progress.update(
+                        task, advance=len(data) / (1024**2)
+                    )  # Convert bytes to MB
+            _check_download_complete(response=response, downloaded=downloaded)
+        except BaseException:
+            # a partial archive must not remain in the record folder
+            archive_file.close()
+            archive_path.unlink()
+            raise
+
+    # Extract the downloaded zip file to the target folder (zipfile verifies the CRC-32 of every member while extracting)
+    try:
+        with zipfile.ZipFile(archive_path) as zip_ref:
+            names = zip_ref.namelist()
+            zip_ref.extractall(record_folder)
+    finally:
+        archive_path.unlink()
+
+    # check if the extracted files are still zips, the archive's name list tells without scanning the record folder
+    for name in names:
+        if "/" not in name and name.endswith(".zip"):
+            nested_zip = record_folder / name
+            _extract_zip_concurrently(zip_path=nested_zip, target_folder=record_folder)
+            nested_zip.unlink()  # remove zip after extraction
+
+
+def _check_download_complete(response: requests.Response, downloaded: int) -> None:
+    """Check that the complete response body was received if the server announced its length.
+
+    Args:
+        response (requests.Response): The streamed response
+        downloaded (int): Number of received bytes
+
+    Raises:
+        ZenodoException: If fewer or more bytes than announced were received
+    """
+    expected = response.headers.get("Content-Length")
+    # the announced length refers to the encoded body, it can only be compared for identity encoded responses
+    if expected is None or response.headers.get("Content-Encoding"):
+        return
+    if downloaded != int(expected):
+        raise ZenodoException(
+            f"Incomplete download of additional files: received {downloaded} of {expected} bytes"
+        )
+
+
+def _extract_zip_concurrently(zip_path: Path, target_folder: Path) -> None:
+    """Extract all members of a zip file using multiple threads (decompression releases the GIL).
+
+    Args:
+        zip_path (Path): Path to the zip file.
+        target_folder (Path): Folder to extract the files to.
+    """
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        files = zip_ref.namelist()
+
+    # ZipFile handles must not be shared between threads, each worker opens its own
+    thread_local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract(file: str) -> None:
+        zip_ref = getattr(thread_local, "zip_ref", None)
+        if zip_ref is None:
+            zip_ref = thread_local.zip_ref = zipfile.ZipFile(zip_path)
+            with handles_lock:
+                handles.append(zip_ref)
+        try:
+            zip_ref.extract(file, target_folder)
+        except FileExistsError:
+            # another thread created a shared parent folder between zipfile's existence check and mkdir
+            zip_ref.extract(file, target_folder)
+
+    try:
+        with Progress(transient=True) as progress, ThreadPoolExecutor(
+            max_workers=min(_MAX_EXTRACTION_WORKERS, os.cpu_count() or 1)
+        ) as executor:
+            task = progress.add_task("[cyan]Extracting files...", total=len(files))
+            futures = [executor.submit(extract, file) for file in files]
+            for i, future in enumerate(as_completed(futures)):
+                future.result()
+                # Update the progress bar
+                progress.update(task, completed=i + 1)
+    finally:
+        for zip_ref in handles:
+            zip_ref.close()
@@ -1,10 +1,12 @@
 import unittest
+from contextlib import nullcontext
 from unittest.mock import MagicMock, patch
 from pathlib import Path
 import tempfile
 import shutil
 
 from brats import AdultGliomaPostTreatmentSegmenter
+from brats.core.brats_algorithm import _configure_default_logger
 from brats.constants import OUTPUT_NAME_SCHEMA
 
 
@@ -37,6 +39,17 @@ class TestBraTSAlgorithm(unittest.TestCase):
         # Remove the temporary directory after the test
         shutil.rmtree(self.test_dir)
 
+    def test_get_tmp_output_parent(self):
+        run_args = self.segmenter.algorithm.run_args
+        with patch.object(run_args, "requires_root", False):
+            self.assertEqual(
+                self.segmenter._get_tmp_output_parent(self.output_folder),
+                self.output_folder,
+            )
+        # root-owned leftovers must not end up in the user's output folder
+        with patch.object(run_args, "requires_root", True):
+            self.assertIsNone(self.segmenter._get_tmp_output_parent(self.output_folder))
+
     @patch("brats.core.brats_algorithm.run_container")
     @patch("brats.core.segmentation_algorithms.input_sanity_check")
     @patch("brats.core.brats_algorithm.InferenceSetup")
@@ -107,3 +120,212 @@ class TestBraTSAlgorithm(unittest.TestCase):
         mock_run_container.assert_called_once()
         output_file = self.output_folder / "A.nii.gz"
         self.assertTrue(output_file.exists())
+
+    @patch("brats.core.brats_algorithm.run_container")
+    @patch("brats.core.segmentation_algorithms.input_sanity_check")
+    def test_infer_batch_output_in_data_folder(
+        self, mock_input_sanity_check, mock_run_container
+    ):
+        def create_output_file(*args, **kwargs):
+            # the temporary output folder is created in the data folder
+            self.assertEqual(kwargs["output_path"].parent, self.data_folder)
+            subject_id = self.segmenter.algorithm.run_args.input_name_schema.format(
+                id=0
+            )
+            (
+                kwargs["output_path"]
+                / OUTPUT_NAME_SCHEMA[self.segmenter.task].format(subject_id=subject_id)
+            ).touch()
+
+        mock_run_container.side_effect = create_output_file
+
+        with patch.object(self.segmenter.algorithm.run_args, "requires_root", False):
+            self.segmenter.infer_batch(
+                data_folder=self.data_folder, output_folder=self.data_folder
+            )
+        # the temporary output folder is not picked up as a subject
+        mock_input_sanity_check.assert_called_once()
+        self.assertEqual(
+            len(mock_run_container.call_args.kwargs["internal_external_name_map"]), 1
+        )
+        self.assertTrue((self.data_folder / "A.nii.gz").exists())
+
+    @patch("brats.core.brats_algorithm.run_container")
+    @patch("brats.core.segmentation_algorithms.input_sanity_check")
+    @patch("brats.core.brats_algorithm.InferenceSetup")
+    def test_infer_many(
+        self, mock_inference_setup, mock_input_sanity_check, mock_run_container
+    ):
+
+        # Mock InferenceSetup context manager
+        mock_inference_setup_ret = mock_inference_setup.return_value
+        mock_inference_setup_ret.__enter__.return_value = (
+            self.data_folder,
+            self.output_folder,
+        )
+
+        def create_output_files(*args, **kwargs):
+            for subject_id in kwargs["internal_external_name_map"]:
+                alg_output_file = self.output_folder / OUTPUT_NAME_SCHEMA[
+                    self.segmenter.task
+                ].format(subject_id=subject_id)
+                alg_output_file.touch()
+
+        mock_run_container.side_effect = create_output_files
+
+        output_files = [
+            self.output_folder / "first.nii.gz",
+            self.output_folder / "second.nii.gz",
+        ]
+        self.segmenter.infer_many(
+            inputs=[self.input_files, self.input_files],
+            output_files=output_files,
+        )
+        self.assertEqual(mock_input_sanity_check.call_count, 2)
+        mock_run_container.assert_called_once()
+
+        for output_file in output_files:
+            self.assertTrue(output_file.exists())
+
+    @patch("brats.core.brats_algorithm.run_container")
+    def test_infer_many_length_mismatch(self, mock_run_container):
+        with self.assertRaises(ValueError):
+            self.segmenter.infer_many(
+                inputs=[self.input_files],
+                output_files=[],
+            )
+        mock_run_container.assert_not_called()
+
+    @patch("brats.core.brats_algorithm.run_container")
+    def test_infer_many_empty(self, mock_run_container):
+        with self.assertRaises(ValueError):
+            self.segmenter.infer_many(inputs=[], output_files=[])
+        mock_run_container.assert_not_called()
+
+    @patch("brats.core.brats_algorithm.prewarm_container")
+    @patch("brats.core.brats_algorithm.run_container")
+    @patch("brats.core.segmentation_algorithms.input_sanity_check")
+    @patch("brats.core.brats_algorithm.InferenceSetup")
+    def test_infer_batch_multiple_cuda_devices(
+        self,
+        mock_inference_setup,
+        mock_input_sanity_check,
+        mock_run_container,
+        mock_prewarm_container,
+    ):
+        # add a second subject
+        subject_B_folder = self.data_folder / "B"
+        subject_B_folder.mkdir(parents=True, exist_ok=True)
+        for modality in self.input_files:
+            (subject_B_folder / f"B-{modality}.nii.gz").touch()
+
+        tmp_data_folder = self.test_dir / "tmp_data"
+        tmp_output_folder = self.test_dir / "tmp_output"
+        tmp_data_folder.mkdir()
+        tmp_output_folder.mkdir()
+        mock_inference_setup_ret = mock_inference_setup.return_value
+        mock_inference_setup_ret.__enter__.return_value = (
+            tmp_data_folder,
+            tmp_output_folder,
+        )
+
+        def create_output_files(*args, **kwargs):
+            kwargs["output_path"].mkdir(parents=True, exist_ok=True)
+            for subject_id in kwargs["internal_external_name_map"]:
+                self.assertTrue((kwargs["data_path"] / subject_id).exists())
+                alg_output_file = kwargs["output_path"] / OUTPUT_NAME_SCHEMA[
+                    self.segmenter.task
+                ].format(subject_id=subject_id)
+                alg_output_file.touch()
+
+        mock_run_container.side_effect = create_output_files
+
+        self.segmenter.cuda_devices = "0,1"
+        self.segmenter.infer_batch(
+            data_folder=self.data_folder, output_folder=self.output_folder
+        )
+        self.assertEqual(mock_run_container.call_count, 2)
+        used_devices = sorted(
+            c.kwargs["cuda_devices"] for c in mock_run_container.call_args_list
+        )
+        self.assertEqual(used_devices, ["0", "1"])
+        # the image is pulled upfront and the concurrent runs share one spinner
+        mock_prewarm_container.assert_called_once_with(
+            algorithm=self.segmenter.algorithm
+        )
+        for c in mock_run_container.call_args_list:
+            self.assertFalse(c.kwargs["show_status"])
+        for subject in ["A", "B"]:
+            self.assertTrue((self.output_folder / f"{subject}.nii.gz").exists())
+
+    @patch("brats.core.brats_algorithm.run_container")
+    @patch("brats.core.segmentation_algorithms.input_sanity_check")
+    @patch("brats.core.brats_algorithm.InferenceSetup")
+    def test_context_manager_reuses_tmp_data_folder(
+        self, mock_inference_setup, mock_input_sanity_check, mock_run_container
+    ):
+        # yield the reused data folder handed over by the algorithm
+        mock_inference_setup.side_effect = lambda **kwargs: nullcontext(
+            (kwargs["tmp_data_folder"], self.output_folder)
+        )
+        subject_id = self.segmenter.algorithm.run_args.input_name_schema.format(id=0)
+        alg_output_file = self.output_folder / OUTPUT_NAME_SCHEMA[
+            self.segmenter.task
+        ].format(subject_id=subject_id)
+        mock_run_container.side_effect = lambda *args, **kwargs: alg_output_file.touch()
+
+        with self.segmenter as segmenter:
+            for i in range(2):
+                segmenter.infer_single(
+                    t1c=self.input_files["t1c"],
+                    t1n=self.input_files["t1n"],
+                    t2f=self.input_files["t2f"],
+                    t2w=self.input_files["t2w"],
+                    output_file=self.output_folder / f"output_{i}.nii.gz",
+                )
+            tmp_data_folder = segmenter._tmp_data_folder
+            self.assertTrue(tmp_data_folder.is_dir())
+
+        used_folders = [
+            c.kwargs["tmp_data_folder"] for c in mock_inference_setup.call_args_list
+        ]
+        self.assertEqual(used_folders, [tmp_data_folder, tmp_data_folder])
+        self.assertFalse(tmp_data_folder.exists())
+        self.assertIsNone(self.segmenter._tmp_data_folder)
+
+    @patch("brats.core.brats_algorithm.force_load")
+    @patch("brats.core.segmentation_algorithms.input_sanity_check")
+    def test_standardize_subjects(self, mock_input_sanity_check, mock_force_load):
+        tmp_data_folder = self.test_dir / "tmp_data"
+        subject_ids = [f"subject_{i}" for i in range(5)]
+        self.segmenter._standardize_subjects(
+            data_folder=tmp_data_folder,
+            subject_inputs={subject_id: self.input_files for subject_id in subject_ids},
+        )
+        self.assertEqual(mock_input_sanity_check.call_count, len(subject_ids))
+        mock_force_load.assert_called_once()
+        for subject_id in subject_ids:
+            self.assertEqual(
+                len(list((tmp_data_folder / subject_id).iterdir())),
+                len(self.input_files),
+            )
+
+    @patch("brats.core.brats_algorithm.prewarm_container")
+    def test_prewarm(self, mock_prewarm_container):
+        self.segmenter.prewarm()
+        mock_prewarm_container.assert_called_once_with(
+            algorithm=self.segmenter.algorithm
+        )
+
+    @patch("brats.core.brats_algorithm.logger")
+    def test_configure_default_logger(self, mock_logger):
+        _configure_default_logger()
+        mock_logger.remove.assert_called_once_with(0)
+        mock_logger.add.assert_called_once()
+
+    @patch("brats.core.brats_algorithm.logger")
+    def test_configure_default_logger_user_configured(self, mock_logger):
+        # default handler already removed by the user
+        mock_logger.remove.side_effect = ValueError()
+        _configure_default_logger()
+        mock_logger.add.assert_not_called()
@@ -1,3 +1,4 @@
+import os
 import shutil
 import subprocess
 import tempfile
@@ -5,21 +6,27 @@ import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, call, patch
 
+import nibabel as nib
 import numpy as np
 from rich.progress import Progress
 
 from brats.core.docker import (
     _build_args,
+    _check_shm_size,
     _ensure_image,
     _get_additional_files_path,
+    _get_image_reference,
     _get_parameters_arg,
     _get_volume_mappings,
     _handle_device_requests,
+    _has_nonzero_voxel,
     _is_cuda_available,
     _log_algorithm_info,
+    _log_pull_lines,
     _observe_docker_output,
     _sanity_check_output,
     _show_docker_pull_progress,
+    prewarm_container,
     run_container,
 )
 from brats.utils.algorithm_config import AlgorithmData
@@ -101,7 +108,8 @@ class TestDockerHelpers(unittest.TestCase):
             _show_docker_pull_progress(tasks, progress, line)
             self.assertIn("[Extract id2]", tasks)
 
-    @patch("brats.core.docker.client.images.list", return_value=[])
+    @patch("brats.core.docker._PRESENT_IMAGES", set())
+    @patch("brats.core.docker.client.images.list", side_effect=[[], ["test-image"]])
     @patch("brats.core.docker.client.api.pull")
     def test_ensure_image(self, MockPull, MockList):
         MockPull.return_value = iter(
@@ -116,8 +124,139 @@ class TestDockerHelpers(unittest.TestCase):
         _ensure_image("test-image:latest")
         MockPull.assert_called_once_with("test-image:latest", stream=True, decode=True)
 
+    @patch("brats.core.docker.client", create=True)
+    def test_ensure_image_cached(self, mock_client):
+        mock_client.images.list.return_value = ["test-image:latest"]
+        with patch("brats.core.docker._PRESENT_IMAGES", set()):
+            _ensure_image("test-image:latest")
+            _ensure_image("test-image:latest")
+        # the daemon is only queried once
+        mock_client.images.list.assert_called_once_with(name="test-image:latest")
+        mock_client.api.pull.assert_not_called()
+
+    @patch("brats.core.docker.Progress")
+    @patch("brats.core.docker.Console")
+    @patch("brats.core.docker._show_docker_pull_progress")
+    @patch("brats.core.docker._log_pull_lines")
+    @patch("brats.core.docker.client", create=True)
+    def test_ensure_image_progress_bars(
+        self,
+        mock_client,
+        mock_log_lines,
+        mock_show_progress,
+        mock_console,
+        mock_progress,
+    ):
+        # terminal and Jupyter notebook
+        for is_terminal, is_jupyter in [(True, False), (False, True)]:
+            self._mock_successful_pull(mock_client)
+            mock_console.return_value.is_terminal = is_terminal
+            mock_console.return_value.is_jupyter = is_jupyter
+            mock_show_progress.reset_mock()
+            with patch("brats.core.docker._PRESENT_IMAGES", set()):
+                _ensure_image("test-image:latest")
+            mock_console.assert_called_with(stderr=True)
+            mock_progress.assert_called_with(console=mock_console.return_value)
+            mock_show_progress.assert_called_once()
+        mock_log_lines.assert_not_called()
+
+    @patch("brats.core.docker.Console")
+    @patch("brats.core.docker._show_docker_pull_progress")
+    @patch("brats.core.docker._log_pull_lines")
+    @patch("brats.core.docker.client", create=True)
+    def test_ensure_image_no_terminal(
+        self, mock_client, mock_log_lines, mock_show_progress, mock_console
+    ):
+        self._mock_successful_pull(mock_client)
+        mock_console.return_value.is_terminal = False
+        mock_console.return_value.is_jupyter = False
+        with patch("brats.core.docker._PRESENT_IMAGES", set()):
+            _ensure_image("test-image:latest")
+        mock_log_lines.assert_called_once()
+        mock_show_progress.assert_not_called()
+
+    @patch("brats.core.docker.Console")
+    @patch("brats.core.docker.client", create=True)
+    def test_ensure_image_pull_error(self, mock_client, mock_console):
+        mock_client.images.list.return_value = []
+        mock_client.api.pull.return_value = iter(
+            [{"status": "Pulling from test-image"}, {"error": "manifest unknown"}]
+        )
+        mock_console.return_value.is_terminal = False
+        mock_console.return_value.is_jupyter = False
+        with patch("brats.core.docker._PRESENT_IMAGES", set()) as present_images:
+            with self.assertRaises(BraTSContainerException) as context:
+                _ensure_image("test-image:latest")
+            # failed pulls are retried by later calls
+            self.assertNotIn("test-image:latest", present_images)
+        self.assertIn("manifest unknown", str(context.exception))
+
+    @patch("brats.core.docker.Console")
+    @patch("brats.core.docker.client", create=True)
+    def test_ensure_image_missing_after_pull(self, mock_client, mock_console):
+        mock_client.images.list.return_value = []
+        mock_client.api.pull.return_value = iter([])
+        mock_console.return_value.is_terminal = False
+        mock_console.return_value.is_jupyter = False
+        with patch("brats.core.docker._PRESENT_IMAGES", set()) as present_images:
+            with self.assertRaises(BraTSContainerException):
+                _ensure_image("test-image:latest")
+            self.assertNotIn("test-image:latest", present_images)
+        self.assertEqual(mock_client.images.list.call_count, 2)
+
+    def _mock_successful_pull(self, mock_client):
+        """Make the image present once it was pulled."""
+        mock_client.images.list.side_effect = [[], ["test-image:latest"]]
+        mock_client.api.pull.return_value = iter([{"status": "Pulling fs layer"}])
+
+    @patch("brats.core.docker.logger")
+    def test_log_pull_lines(self, mock_logger):
+        lines = [{"status": "Pulling fs layer", "id": "layer"}] + [
+            {
+                "status": "Downloading",
+                "id": "layer",
+                "progressDetail": {"total": 100, "current": current},
+            }
+            for current in (1, 5, 12, 15, 25, 100)
+        ]
+        _log_pull_lines(lines)
+        mock_logger.info.assert_has_calls(
+            [
+                call("{}: {}%", "Downloading layer", 1),
+                call("{}: {}%", "Downloading layer", 12),
+                call("{}: {}%", "Downloading layer", 25),
+                call("{}: {}%", "Downloading layer", 100),
+            ]
+        )
+        self.assertEqual(mock_logger.info.call_count, 4)
+
+    def test_get_image_reference(self):
+        self.algorithm_gpu.run_args.docker_image_digest = None
+        self.assertEqual(
+            _get_image_reference(self.algorithm_gpu), "brainles/test-image-1:latest"
+        )
+
+    def test_get_image_reference_pinned(self):
+        self.algorithm_gpu.run_args.docker_image_digest = "sha256:abc123"
+        self.assertEqual(
+            _get_image_reference(self.algorithm_gpu),
+            "brainles/test-image-1@sha256:abc123",
+        )
+
+    def test_get_image_reference_pinned_registry_with_port(self):
+        self.algorithm_gpu.run_args.docker_image = (
+            "registry.local:5000/brainles/test-image-1:latest"
+        )
+        self.algorithm_gpu.run_args.docker_image_digest = "sha256:abc123"
+        self.assertEqual(
+            _get_image_reference(self.algorithm_gpu),
+            "registry.local:5000/brainles/test-image-1@sha256:abc123",
+        )
+
+    @patch("os.path.exists", return_value=False)
     @patch("subprocess.run")
-    def test_is_cuda_available_ok(self, MockRun):
+    def test_is_cuda_available_ok(self, MockRun, MockExists):
+        _is_cuda_available.cache_clear()
         MockRun.return_value = None
         self.assertTrue(_is_cuda_available())
         MockRun.assert_called_once_with(
@@ -127,8 +266,10 @@ class TestDockerHelpers(unittest.TestCase):
             check=True,
         )
 
+    @patch("os.path.exists", return_value=False)
     @patch("subprocess.run")
-    def test_is_cuda_available_fail(self, MockRun):
+    def test_is_cuda_available_fail(self, MockRun, MockExists):
+        _is_cuda_available.cache_clear()
         MockRun.side_effect = Exception()
         self.assertFalse(_is_cuda_available())
         MockRun.assert_called_once_with(
@@ -138,6 +279,25 @@ class TestDockerHelpers(unittest.TestCase):
             check=True,
         )
 
+    @patch("os.path.exists", return_value=False)
+    @patch("subprocess.run")
+    def test_is_cuda_available_cached(self, MockRun, MockExists):
+        _is_cuda_available.cache_clear()
+        MockRun.return_value = None
+        self.assertTrue(_is_cuda_available())
+        self.assertTrue(_is_cuda_available())
+        MockRun.assert_called_once()
+        _is_cuda_available.cache_clear()
+
+    @patch("os.path.exists", return_value=True)
+    @patch("subprocess.run")
+    def test_is_cuda_available_driver_loaded(self, MockRun, MockExists):
+        _is_cuda_available.cache_clear()
+        self.assertTrue(_is_cuda_available())
+        MockExists.assert_called_once_with("/proc/driver/nvidia/version")
+        MockRun.assert_not_called()
+        _is_cuda_available.cache_clear()
+
     @patch("brats.core.docker._is_cuda_available", return_value=True)
     def test_handle_device_requests_cuda(self, MockIsCudaAvailable):
         result = _handle_device_requests(
@@ -171,9 +331,19 @@ class TestDockerHelpers(unittest.TestCase):
     @patch("brats.core.docker.check_additional_files_path")
     def test_get_additional_files_path(self, MockCheckAdditionalFilesPath):
         MockCheckAdditionalFilesPath.return_value = self.test_dir
-        result = _get_additional_files_path(self.algorithm_gpu)
+        with patch("brats.core.docker._ADDITIONAL_FILES_PATHS", {}):
+            result = _get_additional_files_path(self.algorithm_gpu)
         self.assertEqual(result, self.test_dir)
 
+    @patch("brats.core.docker.check_additional_files_path")
+    def test_get_additional_files_path_cached(self, MockCheckAdditionalFilesPath):
+        MockCheckAdditionalFilesPath.return_value = self.test_dir
+        with patch("brats.core.docker._ADDITIONAL_FILES_PATHS", {}):
+            first = _get_additional_files_path(self.algorithm_cpu)
+            second = _get_additional_files_path(self.algorithm_cpu)
+        self.assertEqual(first, second)
+        MockCheckAdditionalFilesPath.assert_called_once()
+
     def test_get_volume_mappings(self):
         result = _get_volume_mappings(
             data_path=self.data_folder,
@@ -183,9 +353,9 @@ class TestDockerHelpers(unittest.TestCase):
         )
         expected = {
             self.data_folder.absolute(): {"bind": "/mlcube_io0", "mode": "rw"},
-            self.test_dir.absolute(): {"bind": "/mlcube_io1", "mode": "rw"},
+            self.test_dir.absolute(): {"bind": "/mlcube_io1", "mode": "ro"},
             self.output_folder.absolute(): {"bind": "/mlcube_io2", "mode": "rw"},
-            PARAMETERS_DIR.absolute(): {"bind": "/mlcube_io3", "mode": "rw"},
+            PARAMETERS_DIR.absolute(): {"bind": "/mlcube_io3", "mode": "ro"},
         }
         self.assertEqual(result, expected)
 
@@ -205,7 +375,28 @@ class TestDockerHelpers(unittest.TestCase):
             expected = f" --parameters_file=/mlcube_io3/{file.name}"
             self.assertEqual(result, expected)
 
-    def test_build_args(self):
+    @patch("brats.core.docker.logger.warning")
+    def test_check_shm_size(self, MockLoggerWarning):
+        self.algorithm_gpu.run_args.ipc_mode = None
+        _check_shm_size(self.algorithm_gpu)
+        MockLoggerWarning.assert_not_called()
+
+    @patch("brats.core.docker.logger.warning")
+    def test_check_shm_size_small(self, MockLoggerWarning):
+        self.algorithm_gpu.run_args.ipc_mode = None
+        self.algorithm_gpu.run_args.shm_size = "512m"
+        _check_shm_size(self.algorithm_gpu)
+        MockLoggerWarning.assert_called_once()
+
+    @patch("brats.core.docker.logger.warning")
+    def test_check_shm_size_small_host_ipc(self, MockLoggerWarning):
+        self.algorithm_gpu.run_args.ipc_mode = "host"
+        self.algorithm_gpu.run_args.shm_size = "512m"
+        _check_shm_size(self.algorithm_gpu)
+        MockLoggerWarning.assert_not_called()
+
+    @patch("brats.core.docker._get_user")
+    def test_build_args(self, mock_get_user):
         result = _build_args(self.algorithm_gpu)
         expected_command_args = [
             "--data_path=/mlcube_io0",
@@ -216,6 +407,13 @@ class TestDockerHelpers(unittest.TestCase):
         for arg in expected_command_args:
             self.assertIn(arg, result[0])
         self.assertEqual(result[1], {})
+        # user ids are not available on all platforms (e.g. Windows) and only resolved when needed
+        mock_get_user.assert_not_called()
+
+    def test_build_args_non_root(self):
+        self.algorithm_gpu.run_args.requires_root = False
+        _, extra_args = _build_args(self.algorithm_gpu)
+        self.assertEqual(extra_args, {"user": f"{os.getuid()}:{os.getgid()}"})
 
     @patch("brats.core.docker.Console")
     @patch("brats.core.docker.docker.models.containers.Container")
@@ -226,6 +424,31 @@ class TestDockerHelpers(unittest.TestCase):
         result = _observe_docker_output(mock_container)
         self.assertEqual(result, "output log line")
 
+    @patch("brats.core.docker.Console")
+    def test_observe_docker_output_multiple_chunks(self, MockConsole):
+        mock_container = MagicMock()
+        mock_container.attach.return_value = iter([b"line 1\n", b"line 2\n"])
+        mock_container.wait.return_value = {"StatusCode": 0}
+        result = _observe_docker_output(mock_container)
+        self.assertEqual(result, "line 1\nline 2\n")
+
+    @patch("brats.core.docker.Console")
+    def test_observe_docker_output_no_status(self, MockConsole):
+        mock_container = MagicMock()
+        mock_container.attach.return_value = [b"output log line"]
+        mock_container.wait.return_value = {"StatusCode": 0}
+        result = _observe_docker_output(mock_container, show_status=False)
+        self.assertEqual(result, "output log line")
+        MockConsole.assert_not_called()
+
+    @patch("brats.core.docker.Console")
+    def test_observe_docker_output_error(self, MockConsole):
+        mock_container = MagicMock()
+        mock_container.attach.return_value = iter([b"Traceback"])
+        mock_container.wait.return_value = {"StatusCode": 1}
+        with self.assertRaises(BraTSContainerException):
+            _observe_docker_output(mock_container)
+
     @patch("brats.core.docker.logger")
     @patch("brats.core.docker.nib.load")
     def test_sanity_check_output(self, mock_nib_load, mock_logger):
@@ -245,7 +468,8 @@ class TestDockerHelpers(unittest.TestCase):
 
         # Create a mock object for the fdata
         mock_nifti_img = MagicMock()
-        mock_nifti_img.get_fdata.return_value = np.ones((2, 2, 2))
+        mock_nifti_img.dataobj = np.ones((2, 2, 2))
+        mock_nifti_img.shape = (2, 2, 2)
 
         # Mock the nib.load to return the mock nifti image
         mock_nib_load.return_value = mock_nifti_img
@@ -282,7 +506,8 @@ class TestDockerHelpers(unittest.TestCase):
 
         # Create a mock object for the fdata
         mock_nifti_img = MagicMock()
-        mock_nifti_img.get_fdata.return_value = np.ones((2, 2, 2))
+        mock_nifti_img.dataobj = np.ones((2, 2, 2))
+        mock_nifti_img.shape = (2, 2, 2)
 
         # Mock the nib.load to return the mock nifti image
         mock_nib_load.return_value = mock_nifti_img
@@ -319,7 +544,8 @@ class TestDockerHelpers(unittest.TestCase):
         # Create a mock object for the fdata
         mock_nifti_img = MagicMock()
         # zeros!
-        mock_nifti_img.get_fdata.return_value = np.zeros((2, 2, 2))
+        mock_nifti_img.dataobj = np.zeros((2, 2, 2))
+        mock_nifti_img.shape = (2, 2, 2)
 
         # Mock the nib.load to return the mock nifti image
         mock_nib_load.return_value = mock_nifti_img
@@ -358,7 +584,8 @@ class TestDockerHelpers(unittest.TestCase):
         # Create a mock object for the fdata
         mock_nifti_img = MagicMock()
         # zeros!
-        mock_nifti_img.get_fdata.return_value = np.zeros((2, 2, 2))
+        mock_nifti_img.dataobj = np.zeros((2, 2, 2))
+        mock_nifti_img.shape = (2, 2, 2)
 
         # Mock the nib.load to return the mock nifti image
         mock_nib_load.return_value = mock_nifti_img
@@ -378,12 +605,43 @@ class TestDockerHelpers(unittest.TestCase):
         # assertions
         mock_logger.warning.assert_called_once()
 
+    @patch("brats.core.docker.nib.load")
+    def test_has_nonzero_voxel_stops_at_first_nonzero_slice(self, mock_nib_load):
+        data = np.zeros((2, 2, 4), dtype=np.uint8)
+        data[0, 0, 0] = 1
+        mock_nifti_img = MagicMock()
+        mock_nifti_img.shape = data.shape
+        mock_nifti_img.dataobj.__getitem__.side_effect = lambda key: data[key]
+        mock_nib_load.return_value = mock_nifti_img
+
+        self.assertTrue(_has_nonzero_voxel(Path("output.nii.gz")))
+        mock_nifti_img.dataobj.__getitem__.assert_called_once_with((Ellipsis, 0))
+
+    def test_has_nonzero_voxel_file(self):
+        data = np.zeros((3, 3, 3), dtype=np.int16)
+        empty_file = self.test_dir / "empty.nii.gz"
+        nib.save(nib.Nifti1Image(data, np.eye(4)), empty_file)
+        data[1, 1, 2] = 4
+        non_empty_file = self.test_dir / "non_empty.nii.gz"
+        nib.save(nib.Nifti1Image(data, np.eye(4)), non_empty_file)
+
+        self.assertFalse(_has_nonzero_voxel(empty_file))
+        self.assertTrue(_has_nonzero_voxel(non_empty_file))
+
     @patch("brats.core.docker.logger.debug")
     def test_log_algorithm_info(self, MockLoggerDebug):
         _log_algorithm_info(algorithm=self.algorithm_gpu)
 
         MockLoggerDebug.assert_called_once()
 
+    @patch("brats.core.docker._ensure_image")
+    @patch("brats.core.docker._get_additional_files_path")
+    def test_prewarm_container(self, mock_get_additional_files_path, mock_ensure_image):
+        self.algorithm_gpu.run_args.docker_image_digest = None
+        prewarm_container(algorithm=self.algorithm_gpu)
+        mock_ensure_image.assert_called_once_with(image="brainles/test-image-1:latest")
+        mock_get_additional_files_path.assert_called_once_with(self.algorithm_gpu)
+
     @patch("brats.core.docker._log_algorithm_info")
     @patch("brats.core.docker._ensure_image")
     @patch("brats.core.docker._get_additional_files_path")
@@ -264,6 +264,37 @@ class TestSegmentationAlgorithms(unittest.TestCase):
 
         mock_infer_single.assert_not_called()
 
+    @patch("brats.core.segmentation_algorithms.MeningiomaSegmenter._infer_many")
+    def test_meningioma_segmenter_infer_many_2024_valid(self, mock_infer_many):
+        segmenter = MeningiomaSegmenter(algorithm=MeningiomaAlgorithms.BraTS24_1)
+
+        segmenter.infer_many(
+            inputs=[{"t1c": self.t1c}, {"t1c": self.t1c}],
+            output_files=[
+                self.tmp_data_folder / "output_1.nii.gz",
+                self.tmp_data_folder / "output_2.nii.gz",
+            ],
+        )
+
+        mock_infer_many.assert_called_once()
+
+    @patch("brats.core.segmentation_algorithms.MeningiomaSegmenter._infer_many")
+    def test_meningioma_segmenter_infer_many_2024_invalid_too_many_files(
+        self, mock_infer_many
+    ):
+        segmenter = MeningiomaSegmenter(algorithm=MeningiomaAlgorithms.BraTS24_1)
+
+        with self.assertRaises(ValueError):
+            segmenter.infer_many(
+                inputs=[{"t1c": self.t1c}, {"t1c": self.t1c, "t2w": self.t2w}],
+                output_files=[
+                    self.tmp_data_folder / "output_1.nii.gz",
+                    self.tmp_data_folder / "output_2.nii.gz",
+                ],
+            )
+
+        mock_infer_many.assert_not_called()
+
     @patch("brats.core.brats_algorithm.BraTSAlgorithm._process_batch_output")
     @patch("brats.core.brats_algorithm.run_container")
     @patch(
@@ -1,7 +1,8 @@
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
-from brats.utils.algorithm_config import load_algorithms
+from brats.utils.algorithm_config import _load_algorithms, load_algorithms
 from brats.constants import META_DIR
 
 
@@ -19,3 +20,14 @@ class TestAlgorithmConfig(unittest.TestCase):
                 load_algorithms(file_path=config)
             except Exception as e:
                 self.fail(f"Failed to load config {config}: {e}")
+
+    def test_load_algorithms_cached(self):
+        config = META_DIR / "adult_glioma_pre_treatment.yml"
+        with patch("brats.utils.algorithm_config.yaml.load") as mock_yaml_load:
+            _load_algorithms.cache_clear()
+            mock_yaml_load.return_value = {"algorithms": {}}
+            first = load_algorithms(file_path=config)
+            second = load_algorithms(file_path=str(config))
+            mock_yaml_load.assert_called_once()
+            self.assertIs(first, second)
+        _load_algorithms.cache_clear()
@@ -1,15 +1,23 @@
+import errno
 import shutil
 import tempfile
 import unittest
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import nibabel as nib
+import numpy as np
 from loguru import logger
 
 from brats.utils.data_handling import (
     InferenceSetup,
+    _read_nifti_shape,
     add_log_file_handler,
+    clear_tmp_folder,
+    copy_file,
+    find_subject_folders,
     input_sanity_check,
+    move_file,
     remove_tmp_folder,
 )
 
@@ -76,12 +84,51 @@ class TestDataHandlingUtils(unittest.TestCase):
         self.assertFalse(tmp_data_folder.exists())
         self.assertFalse(tmp_output_folder.exists())
 
+    def test_inference_setup_with_tmp_output_parent(self):
+        with InferenceSetup(tmp_output_parent=self.test_dir) as (
+            tmp_data_folder,
+            tmp_output_folder,
+        ):
+            self.assertEqual(tmp_output_folder.parent, self.test_dir)
+            self.assertTrue(tmp_output_folder.name.startswith(".brats_output_"))
+
+        self.assertFalse(tmp_data_folder.exists())
+        self.assertFalse(tmp_output_folder.exists())
+
+    def test_inference_setup_with_tmp_data_folder(self):
+        with InferenceSetup(tmp_data_folder=self.tmp_data_folder) as (
+            tmp_data_folder,
+            tmp_output_folder,
+        ):
+            self.assertEqual(tmp_data_folder, self.tmp_data_folder)
+
+        # provided data folder is left in place
+        self.assertTrue(self.tmp_data_folder.exists())
+        self.assertFalse(tmp_output_folder.exists())
+
+    def test_clear_tmp_folder(self):
+        (self.tmp_data_folder / "subject").mkdir()
+        (self.tmp_data_folder / "subject" / "subject-t1c.nii.gz").touch()
+        (self.tmp_data_folder / "file.txt").touch()
+        clear_tmp_folder(self.tmp_data_folder)
+        self.assertTrue(self.tmp_data_folder.exists())
+        self.assertFalse(any(self.tmp_data_folder.iterdir()))
+
     def test_remove_tmp_folder_success(self):
         # Test successful removal of a folder
         temp_folder = Path(tempfile.mkdtemp())
         remove_tmp_folder(temp_folder)
         self.assertFalse(temp_folder.exists())
 
+    def test_remove_tmp_folder_with_subject_folders(self):
+        temp_folder = Path(tempfile.mkdtemp())
+        for i in range(3):
+            (temp_folder / f"subject_{i}").mkdir()
+            (temp_folder / f"subject_{i}" / "t1c.nii.gz").touch()
+        (temp_folder / "file.txt").touch()
+        remove_tmp_folder(temp_folder)
+        self.assertFalse(temp_folder.exists())
+
     def test_remove_tmp_folder_permission_error(self):
         # Test handling of PermissionError
         # Create a folder and then set it to read-only to simulate a permission error
@@ -101,6 +148,51 @@ class TestDataHandlingUtils(unittest.TestCase):
         remove_tmp_folder(fake_folder)
         # No assertion needed as the function should handle the error internally
 
+    def test_copy_file(self):
+        self.t1c.write_bytes(b"t1c data")
+        dst = self.test_dir / "copied.nii.gz"
+        copy_file(self.t1c, dst)
+        self.assertEqual(dst.read_bytes(), b"t1c data")
+        self.assertFalse(dst.samefile(self.t1c))
+
+    @patch("brats.utils.data_handling.shutil.copyfile")
+    @patch("brats.utils.data_handling.os.copy_file_range", create=True)
+    def test_copy_file_fallback(self, mock_copy_file_range, mock_copyfile):
+        self.t1c.write_bytes(b"t1c data")
+        mock_copy_file_range.side_effect = OSError(errno.ENOSYS, "Not implemented")
+        dst = self.test_dir / "copied.nii.gz"
+        copy_file(self.t1c, dst)
+        mock_copyfile.assert_called_once_with(self.t1c, dst)
+
+    def test_move_file(self):
+        dst = self.test_dir / "moved.nii.gz"
+        move_file(self.t1c, dst)
+        self.assertTrue(dst.exists())
+        self.assertFalse(self.t1c.exists())
+
+    @patch("brats.utils.data_handling.shutil.move")
+    @patch("brats.utils.data_handling.os.replace")
+    def test_move_file_cross_device(self, mock_replace, mock_move):
+        mock_replace.side_effect = OSError(errno.EXDEV, "Invalid cross-device link")
+        dst = self.test_dir / "moved.nii.gz"
+        move_file(self.t1c, dst)
+        mock_move.assert_called_once_with(self.t1c, dst)
+
+    def test_find_subject_folders(self):
+        (self.data_folder / "subject2").mkdir()
+        (self.data_folder / "a_subject").mkdir()
+        (self.data_folder / ".brats_output_abc").mkdir()
+        subjects = find_subject_folders(self.data_folder)
+        # loose files and hidden folders are ignored, subjects are sorted by name
+        self.assertEqual(
+            subjects,
+            [
+                self.data_folder / "a_subject",
+                self.subject_folder,
+                self.data_folder / "subject2",
+            ],
+        )
+
     def test_add_log_file_handler(self):
         # Test adding a log file handler
         log_file = Path(tempfile.mktemp())
@@ -114,13 +206,10 @@ class TestDataHandlingUtils(unittest.TestCase):
         logger.remove(handler_id)
         log_file.unlink(missing_ok=True)
 
-    @patch("brats.utils.data_handling.nib.load")
+    @patch("brats.utils.data_handling._read_nifti_shape")
     @patch("brats.utils.data_handling.logger.warning")
-    def test_input_sanity_check_correct_shape(self, mock_warning, mock_nib_load):
-        # Mock nib.load to return an object with shape (240, 240, 155)
-        mock_img = MagicMock()
-        mock_img.shape = (240, 240, 155)
-        mock_nib_load.return_value = mock_img
+    def test_input_sanity_check_correct_shape(self, mock_warning, mock_read_shape):
+        mock_read_shape.return_value = (240, 240, 155)
 
         # Call the function with correct shapes
         input_sanity_check("t1c.nii.gz", "t1n.nii.gz", "t2f.nii.gz", "t2w.nii.gz")
@@ -128,25 +217,38 @@ class TestDataHandlingUtils(unittest.TestCase):
         # Ensure no warnings are logged
         mock_warning.assert_not_called()
 
-    @patch("brats.utils.data_handling.nib.load")
+    @patch("brats.utils.data_handling._read_nifti_shape")
     @patch("brats.utils.data_handling.logger.warning")
-    def test_input_sanity_check_incorrect_shape(self, mock_warning, mock_nib_load):
-        # Mock nib.load to return an object with shape (191, 512, 512) for one image
-        mock_img_correct = MagicMock()
-        mock_img_correct.shape = (240, 240, 155)
-        mock_img_incorrect = MagicMock()
-        mock_img_incorrect.shape = (191, 512, 512)
+    def test_input_sanity_check_incorrect_shape(self, mock_warning, mock_read_shape):
+        # Mock shape (191, 512, 512) for one image
 
         def side_effect(arg):
             if arg == "t1c.nii.gz":
-                return mock_img_incorrect
+                return (191, 512, 512)
             else:
-                return mock_img_correct
+                return (240, 240, 155)
 
-        mock_nib_load.side_effect = side_effect
+        mock_read_shape.side_effect = side_effect
 
         # Call the function with one incorrect shape
         input_sanity_check("t1c.nii.gz", "t1n.nii.gz", "t2f.nii.gz", "t2w.nii.gz")
 
         # Ensure warnings are logged
         self.assertTrue(mock_warning.called)
+
+    def test_read_nifti_shape(self):
+        for file_name in ["image.nii.gz", "image.nii"]:
+            img_file = self.test_dir / file_name
+            nib.Nifti1Image(np.zeros((4, 5, 6), dtype=np.uint8), np.eye(4)).to_filename(
+                img_file
+            )
+            self.assertEqual(_read_nifti_shape(img_file), (4, 5, 6))
+
+    @patch("brats.utils.data_handling.nib.load")
+    def test_read_nifti_shape_fallback(self, mock_nib_load):
+        mock_nib_load.return_value.shape = (240, 240, 155)
+        # not a NIfTI-1 header
+        img_file = self.test_dir / "image.nii"
+        img_file.write_bytes(b"\0" * 540)
+        self.assertEqual(_read_nifti_shape(img_file), (240, 240, 155))
+        mock_nib_load.assert_called_once_with(img_file, mmap=False)
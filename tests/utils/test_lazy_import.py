@@ -0,0 +1,33 @@
+import sys
+import unittest
+from types import ModuleType
+from unittest.mock import patch
+
+from brats.utils.lazy_import import force_load, lazy_import
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def test_lazy_import_already_imported(self):
+        self.assertIs(lazy_import("unittest"), sys.modules["unittest"])
+
+    def test_lazy_import_deferred(self):
+        with patch.dict(sys.modules):
+            sys.modules.pop("colorsys", None)
+            module = lazy_import("colorsys")
+            self.assertIs(sys.modules["colorsys"], module)
+            # module is executed on first attribute access
+            self.assertEqual(module.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+
+    def test_force_load(self):
+        with patch.dict(sys.modules):
+            sys.modules.pop("colorsys", None)
+            module = lazy_import("colorsys")
+            self.assertIsNot(type(module), ModuleType)
+            force_load(module)
+            # the module was executed and turned into a regular module
+            self.assertIs(type(module), ModuleType)
+
+    def test_lazy_import_missing(self):
+        with self.assertRaises(ModuleNotFoundError):
+            lazy_import("not_an_existing_module")
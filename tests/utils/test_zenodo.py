@@ -1,5 +1,6 @@
 import tempfile
 import unittest
+import zipfile
 from unittest.mock import patch, MagicMock, mock_open, call
 from pathlib import Path
 from io import BytesIO
@@ -7,9 +8,19 @@ import requests
 
 # Import the module that contains the functions
 from brats.constants import ADDITIONAL_FILES_FOLDER
+from brats.utils.exceptions import ZenodoException
 from brats.utils.zenodo import (
+    CHECK_UPDATES_ENV_VAR,
+    VERIFIED_MARKER,
+    _REQUEST_TIMEOUT,
+    _cache_metadata,
     _extract_archive,
+    _find_record_folders,
+    _is_complete_record_folder,
+    _get_session,
+    _load_cached_metadata,
     check_additional_files_path,
+    get_dummy_path,
     _get_latest_version_folder_name,
     _get_zenodo_metadata_and_archive_url,
     _download_additional_files,
@@ -18,15 +29,34 @@ from brats.utils.zenodo import (
 
 class TestZenodoUtils(unittest.TestCase):
 
+    def test_find_record_folders(self):
+        additional_files_folder = Path(tempfile.mkdtemp())
+        for name in ["12345_v1.0.0", "12345_v1.1.0", "67890_v1.0.0", "12345_vx"]:
+            (additional_files_folder / name).mkdir()
+        (additional_files_folder / "12345_v2.0.0.zip.part").touch()
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", additional_files_folder
+        ):
+            folders = _find_record_folders("12345")
+        self.assertEqual(
+            sorted(f.name for f in folders), ["12345_v1.0.0", "12345_v1.1.0"]
+        )
+
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER",
+            additional_files_folder / "missing",
+        ):
+            self.assertEqual(_find_record_folders("12345"), [])
+
     @patch("brats.utils.zenodo._get_zenodo_metadata_and_archive_url")
     @patch("brats.utils.zenodo._get_latest_version_folder_name")
     @patch("brats.utils.zenodo._download_additional_files")
     @patch("brats.utils.zenodo.shutil.rmtree")
     @patch("brats.utils.zenodo.Path.mkdir")
-    @patch("brats.utils.zenodo.Path.glob")
+    @patch("brats.utils.zenodo._find_record_folders")
     def test_check_additional_files_path(
         self,
-        mock_glob,
+        mock_find_record_folders,
         mock_mkdir,
         mock_rmtree,
         mock_download_additional_files,
@@ -37,30 +67,86 @@ class TestZenodoUtils(unittest.TestCase):
         mock_record_id = "12345"
         mock_matching_folder = MagicMock(spec=Path)
         mock_matching_folder.name = f"{mock_record_id}_v1.0.0"
-        mock_glob.return_value = [mock_matching_folder]
+        mock_find_record_folders.return_value = [mock_matching_folder]
         mock_get_latest_version.return_value = f"{mock_record_id}_v1.0.0"
         mock_get_zenodo_metadata.return_value = (
             {"version": "1.0.0"},
             "http://test.url",
         )
 
-        # Test when local additional_files are up-to-date
-        result = check_additional_files_path(mock_record_id)
+        # Test when local additional_files are present, Zenodo is not contacted by default
+        with patch.dict("os.environ", {CHECK_UPDATES_ENV_VAR: ""}):
+            result = check_additional_files_path(mock_record_id)
         self.assertEqual(result, ADDITIONAL_FILES_FOLDER / f"{mock_record_id}_v1.0.0")
-        mock_rmtree.assert_not_called()
-        mock_download_additional_files.assert_not_called()
+        mock_get_zenodo_metadata.assert_not_called()
 
-        # Test when new additional_files are available
-        mock_get_zenodo_metadata.return_value = (
-            {"version": "2.0.0"},
-            "http://test.url",
-        )
-        result = check_additional_files_path(mock_record_id)
-        mock_rmtree.assert_called_once()
-        mock_download_additional_files.assert_called_once()
+        with patch.dict("os.environ", {CHECK_UPDATES_ENV_VAR: "1"}):
+            # Test when local additional_files are up-to-date
+            result = check_additional_files_path(mock_record_id)
+            self.assertEqual(
+                result, ADDITIONAL_FILES_FOLDER / f"{mock_record_id}_v1.0.0"
+            )
+            mock_rmtree.assert_not_called()
+            mock_download_additional_files.assert_not_called()
+
+            # Test when new additional_files are available
+            mock_get_zenodo_metadata.return_value = (
+                {"version": "2.0.0"},
+                "http://test.url",
+            )
+            result = check_additional_files_path(mock_record_id)
+            mock_rmtree.assert_called_once()
+            mock_download_additional_files.assert_called_once()
+
+    @patch("brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp()))
+    def test_get_dummy_path(self):
+        get_dummy_path.cache_clear()
+        with patch("brats.utils.zenodo.Path.mkdir") as mock_mkdir:
+            dummy = get_dummy_path()
+            self.assertIs(dummy, get_dummy_path())
+            mock_mkdir.assert_called_once_with(exist_ok=True, parents=True)
+        get_dummy_path.cache_clear()
 
-    @patch("brats.utils.zenodo.requests.get")
-    def test_get_zenodo_metadata_and_archive_url(self, mock_get):
+    def test_get_session(self):
+        _get_session.cache_clear()
+        session = _get_session()
+        self.assertIs(session, _get_session())
+        self.assertEqual(session.get_adapter("https://zenodo.org").max_retries.total, 3)
+        _get_session.cache_clear()
+
+    @patch("brats.utils.zenodo._get_zenodo_metadata_and_archive_url")
+    @patch("brats.utils.zenodo._download_additional_files")
+    @patch("brats.utils.zenodo._find_record_folders")
+    def test_check_additional_files_path_zenodo_unreachable(
+        self,
+        mock_find_record_folders,
+        mock_download_additional_files,
+        mock_get_zenodo_metadata,
+    ):
+        mock_get_zenodo_metadata.side_effect = ZenodoException("unreachable")
+
+        # nothing downloaded yet
+        mock_find_record_folders.return_value = []
+        with self.assertRaises(ZenodoException):
+            check_additional_files_path("12345")
+
+        # fall back to the local additional files when checking for updates
+        folder = Path(tempfile.mkdtemp()) / "12345_v1.0.0"
+        folder.mkdir()
+        (folder / VERIFIED_MARKER).write_text("12345\n1.0.0")
+        mock_find_record_folders.return_value = [folder]
+        with patch.dict("os.environ", {CHECK_UPDATES_ENV_VAR: "1"}):
+            result = check_additional_files_path("12345")
+        self.assertEqual(result, ADDITIONAL_FILES_FOLDER / "12345_v1.0.0")
+        mock_download_additional_files.assert_not_called()
+
+    @patch("brats.utils.zenodo._cache_metadata")
+    @patch("brats.utils.zenodo._load_cached_metadata", return_value=None)
+    @patch("brats.utils.zenodo._get_session")
+    def test_get_zenodo_metadata_and_archive_url(
+        self, mock_get_session, mock_load_cached_metadata, mock_cache_metadata
+    ):
+        mock_get = mock_get_session.return_value.get
         # Setup
         mock_response = MagicMock(spec=requests.Response)
         mock_response.status_code = 200
@@ -73,25 +159,83 @@ class TestZenodoUtils(unittest.TestCase):
         metadata, archive_url = _get_zenodo_metadata_and_archive_url("12345")
         self.assertEqual(metadata, {"version": "1.0.0"})
         self.assertEqual(archive_url, "http://test.url")
+        mock_cache_metadata.assert_called_once_with(
+            record_id="12345",
+            metadata={"version": "1.0.0"},
+            archive_url="http://test.url",
+        )
 
         # Test when the request fails
         mock_get.side_effect = requests.exceptions.RequestException("Failed")
-        ret = _get_zenodo_metadata_and_archive_url("12345")
-        self.assertIsNone(ret)
+        with self.assertRaises(ZenodoException):
+            _get_zenodo_metadata_and_archive_url("12345")
+
+        # Test when the record is not found
+        mock_get.side_effect = None
+        mock_response.status_code = 404
+        with self.assertRaises(ZenodoException):
+            _get_zenodo_metadata_and_archive_url("12345")
+
+    @patch("brats.utils.zenodo._get_session")
+    def test_get_zenodo_metadata_and_archive_url_cached(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp())
+        ):
+            _cache_metadata("12345", {"version": "1.0.0"}, "http://test.url")
+            with patch.dict("os.environ", {CHECK_UPDATES_ENV_VAR: ""}):
+                metadata, archive_url = _get_zenodo_metadata_and_archive_url("12345")
+            self.assertEqual(metadata, {"version": "1.0.0"})
+            self.assertEqual(archive_url, "http://test.url")
+            mock_get.assert_not_called()
+
+            # expired entries are ignored
+            with patch("brats.utils.zenodo.METADATA_CACHE_TTL", 0):
+                self.assertIsNone(_load_cached_metadata("12345"))
+            # unknown records are not cached
+            self.assertIsNone(_load_cached_metadata("67890"))
+
+    @patch("brats.utils.zenodo._get_session")
+    def test_get_zenodo_metadata_and_archive_url_check_updates(self, mock_get_session):
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "metadata": {"version": "2.0.0"},
+            "links": {"archive": "http://test.url/new"},
+        }
+        mock_get = mock_get_session.return_value.get
+        mock_get.return_value = mock_response
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp())
+        ):
+            _cache_metadata("12345", {"version": "1.0.0"}, "http://test.url")
+            # checking for updates bypasses the (not yet expired) cache
+            with patch.dict("os.environ", {CHECK_UPDATES_ENV_VAR: "1"}):
+                metadata, archive_url = _get_zenodo_metadata_and_archive_url("12345")
+            mock_get.assert_called_once()
+            self.assertEqual(metadata, {"version": "2.0.0"})
+            self.assertEqual(archive_url, "http://test.url/new")
+            # the fresh response replaces the cached one
+            self.assertEqual(
+                _load_cached_metadata("12345"),
+                ({"version": "2.0.0"}, "http://test.url/new"),
+            )
 
     @patch("brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp()))
     @patch("brats.utils.zenodo._extract_archive")
-    @patch("brats.utils.zenodo.requests.get")
+    @patch("brats.utils.zenodo._get_session")
     def test_download_additional_files(
         self,
-        mock_requests_get,
+        mock_get_session,
         mock_extract_archive,
     ):
+        mock_requests_get = mock_get_session.return_value.get
         # Setup
         mock_zenodo_metadata = {"version": "1.0.0"}
         mock_archive_url = "http://test.url"
         mock_response = MagicMock(spec=requests.Response)
         mock_response.status_code = 200
+        mock_response.headers = {"Content-Length": "4"}
         mock_response.iter_content = MagicMock(return_value=[b"data"])
         mock_requests_get.return_value = mock_response
 
@@ -102,43 +246,176 @@ class TestZenodoUtils(unittest.TestCase):
 
         # Assertions
         # mock_mkdir.assert_called_once_with(parents=True, exist_ok=True)
-        mock_requests_get.assert_called_once_with(mock_archive_url, stream=True)
+        mock_requests_get.assert_called_once_with(
+            mock_archive_url, stream=True, timeout=_REQUEST_TIMEOUT
+        )
         # mock_zipfile_instance.extractall.assert_called_once_with(result_path)
         mock_extract_archive.assert_called_once()
+        mock_response.close.assert_called_once()
+        self.assertEqual(result_path.name, "12345_v1.0.0")
+        self.assertTrue((result_path / VERIFIED_MARKER).exists())
+
+    @patch("brats.utils.zenodo._extract_archive")
+    @patch("brats.utils.zenodo._get_session")
+    def test_download_additional_files_failed_request(
+        self, mock_get_session, mock_extract_archive
+    ):
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.status_code = 404
+        mock_get_session.return_value.get.return_value = mock_response
+
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp())
+        ):
+            with self.assertRaises(ZenodoException):
+                _download_additional_files({"version": "1.0.0"}, "12345", "url")
+
+        mock_extract_archive.assert_not_called()
+        # the pooled connection is released
+        mock_response.close.assert_called_once()
 
-    @patch("brats.utils.zenodo.zipfile.ZipFile")
-    @patch("brats.utils.zenodo.BytesIO", new_callable=MagicMock)
     @patch("brats.utils.zenodo.Progress")
-    def test_extract_archive(self, mock_progress, mock_bytes_io, mock_zipfile):
+    @patch("brats.utils.zenodo._get_session")
+    def test_download_additional_files_interrupted(
+        self, mock_get_session, mock_progress
+    ):
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.iter_content.side_effect = KeyboardInterrupt
+        mock_get_session.return_value.get.return_value = mock_response
+        additional_files_folder = Path(tempfile.mkdtemp())
+
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", additional_files_folder
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                _download_additional_files({"version": "1.0.0"}, "12345", "url")
+            # neither a record folder nor the staging folder remain
+            self.assertEqual(list(additional_files_folder.iterdir()), [])
+            self.assertEqual(_find_record_folders("12345"), [])
+
+    @patch("brats.utils.zenodo.Progress")
+    @patch("brats.utils.zenodo._get_session")
+    def test_download_additional_files_replaces_incomplete_folder(
+        self, mock_get_session, mock_progress
+    ):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_ref:
+            zip_ref.writestr("weights/model.pth", b"weights")
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.iter_content.return_value = [archive.getvalue()]
+        mock_get_session.return_value.get.return_value = mock_response
+        additional_files_folder = Path(tempfile.mkdtemp())
+        # leftover of a download killed by an older version
+        incomplete_folder = additional_files_folder / "12345_v1.0.0"
+        incomplete_folder.mkdir()
+        (incomplete_folder / "tmpabc.zip.part").write_bytes(b"partial")
+
+        with patch(
+            "brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", additional_files_folder
+        ):
+            result_path = _download_additional_files(
+                {"version": "1.0.0"}, "12345", "url"
+            )
+
+        self.assertEqual(result_path, incomplete_folder)
+        self.assertEqual(
+            sorted(f.name for f in result_path.iterdir()), [VERIFIED_MARKER, "weights"]
+        )
+        self.assertEqual(
+            [f.name for f in additional_files_folder.iterdir()], ["12345_v1.0.0"]
+        )
+
+    @patch("brats.utils.zenodo.ADDITIONAL_FILES_FOLDER", Path(tempfile.mkdtemp()))
+    @patch("brats.utils.zenodo._extract_archive")
+    @patch("brats.utils.zenodo.shutil.disk_usage")
+    @patch("brats.utils.zenodo._get_session")
+    def test_download_additional_files_not_enough_disk_space(
+        self, mock_get_session, mock_disk_usage, mock_extract_archive
+    ):
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Length": str(10 * 1024**3)}
+        mock_get_session.return_value.get.return_value = mock_response
+        mock_disk_usage.return_value.free = 1024**3
+
+        with self.assertRaises(ZenodoException):
+            _download_additional_files({"version": "1.0.0"}, "12345", "url")
+
+        mock_extract_archive.assert_not_called()
+        mock_response.close.assert_called_once()
+
+    @patch("brats.utils.zenodo.Progress")
+    def test_extract_archive(self, mock_progress):
         # Setup
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_ref:
+            zip_ref.writestr("weights/model.pth", b"weights")
+        archive = archive.getvalue()
         mock_response = MagicMock(spec=requests.Response)
-        mock_response.iter_content.return_value = [b"data"]
-        mock_record_folder = MagicMock(spec=Path)
+        mock_response.headers = {"Content-Length": str(len(archive))}
+        mock_response.iter_content.return_value = [archive[:10], archive[10:]]
+        record_folder = Path(tempfile.mkdtemp())
+
+        # Call the function
+        _extract_archive(mock_response, record_folder)
+
+        self.assertEqual(
+            (record_folder / "weights" / "model.pth").read_bytes(), b"weights"
+        )
+        # the downloaded archive is removed after extraction
+        self.assertEqual([f.name for f in record_folder.iterdir()], ["weights"])
 
-        mock_bytes_io_instance = MagicMock(spec=BytesIO)
-        mock_bytes_io.return_value = mock_bytes_io_instance  # Mock the instantiation
+    @patch("brats.utils.zenodo.Progress")
+    def test_extract_archive_incomplete(self, mock_progress):
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.headers = {"Content-Length": "100"}
+        mock_response.iter_content.return_value = [b"truncated"]
+        record_folder = Path(tempfile.mkdtemp())
 
-        mock_zipfile_instance = MagicMock()
-        mock_zipfile.return_value.__enter__.return_value = mock_zipfile_instance
+        with self.assertRaises(ZenodoException):
+            _extract_archive(mock_response, record_folder)
+        # the partial download is removed
+        self.assertFalse(any(record_folder.iterdir()))
+
+    @patch("brats.utils.zenodo.Progress")
+    def test_extract_archive_nested(self, mock_progress):
+        # Setup, the Zenodo archive contains a zip with the actual files
+        nested = BytesIO()
+        with zipfile.ZipFile(nested, "w") as zip_ref:
+            for i in range(10):
+                zip_ref.writestr(f"weights/fold_{i}/model.pth", f"weights {i}")
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_ref:
+            zip_ref.writestr("weights.zip", nested.getvalue())
+        mock_response = MagicMock(spec=requests.Response)
+        mock_response.headers = {}
+        mock_response.iter_content.return_value = [archive.getvalue()]
+        record_folder = Path(tempfile.mkdtemp())
 
         # Call the function
-        _extract_archive(mock_response, mock_record_folder)
+        _extract_archive(mock_response, record_folder)
+
+        for i in range(10):
+            self.assertEqual(
+                (record_folder / "weights" / f"fold_{i}" / "model.pth").read_text(),
+                f"weights {i}",
+            )
+        self.assertFalse((record_folder / "weights.zip").exists())
 
     def test_get_latest_version_folder_name(self):
-        # Test case when folders are provided
-        folder1 = MagicMock(spec=Path)
-        folder1.name = "12345_v1.0.0"
-        folder1.__str__.return_value = "12345_v1.0.0"
-        folder2 = MagicMock(spec=Path)
-        folder2.name = "12345_v2.0.0"
-        folder2.__str__.return_value = "12345_v2.0.0"
-        folder3 = MagicMock(spec=Path)
-        folder3.name = "12345_v1.5.0"
-        folder3.__str__.return_value = "12345_v1.5.0"
-
-        folder2.glob.return_value = ["not empty"]
-        folder1.glob.return_value = ["not empty"]
-        folder3.glob.return_value = []
+        base_folder = Path(tempfile.mkdtemp())
+        folder1 = base_folder / "12345_v1.0.0"
+        folder2 = base_folder / "12345_v2.0.0"
+        folder3 = base_folder / "12345_v1.5.0"
+        for folder in [folder1, folder2, folder3]:
+            folder.mkdir()
+        # folders downloaded before markers were written
+        (folder1 / "weights").mkdir()
+        (folder2 / "weights").mkdir()
 
         result = _get_latest_version_folder_name([folder1, folder2, folder3])
         self.assertEqual(result, "12345_v2.0.0")
@@ -148,6 +425,30 @@ class TestZenodoUtils(unittest.TestCase):
         self.assertIsNone(result)
 
         # Test case when folder is empty
-        folder2.glob.return_value = []
-        result = _get_latest_version_folder_name([folder1, folder2])
+        result = _get_latest_version_folder_name([folder1, folder3])
         self.assertIsNone(result)
+
+    def test_is_complete_record_folder(self):
+        folder = Path(tempfile.mkdtemp()) / "12345_v1.0.0"
+        folder.mkdir()
+        self.assertFalse(_is_complete_record_folder(folder))
+
+        # partial download of a killed process
+        (folder / "tmpabc.zip.part").write_bytes(b"partial")
+        self.assertFalse(_is_complete_record_folder(folder))
+
+        # verified marker takes precedence
+        (folder / VERIFIED_MARKER).write_text("12345\n1.0.0")
+        self.assertTrue(_is_complete_record_folder(folder))
+
+        # marker of another record or version
+        (folder / VERIFIED_MARKER).write_text("12345\n0.9.0")
+        self.assertFalse(_is_complete_record_folder(folder))
+        (folder / VERIFIED_MARKER).write_text("67890\n1.0.0")
+        self.assertFalse(_is_complete_record_folder(folder))
+
+        # folders from older versions without marker
+        (folder / VERIFIED_MARKER).unlink()
+        (folder / "tmpabc.zip.part").unlink()
+        (folder / "weights").mkdir()
+        self.assertTrue(_is_complete_record_folder(folder))